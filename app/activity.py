@@ -0,0 +1,126 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "10000"))
+ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", "500"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "1"))
+
+VIEWED_PRODUCT = "Просмотрел товар"
+ADDED_TO_CART = "Добавил товар в корзину"
+REMOVED_FROM_CART = "Удалил товар из корзины"
+STARTED_CHECKOUT = "Перешел к оформлению заказа"
+PLACED_ORDER = "Оформил заказ"
+
+
+class ActivityLog:
+    """Буфер событий пользователей с фоновой пакетной записью в user_logs.
+
+    emit() никогда не блокирует обработчик: при переполненной очереди событие
+    отбрасывается и учитывается в счётчике dropped.
+    """
+
+    def __init__(self, pool, queue_size=ACTIVITY_QUEUE_SIZE, flush_size=ACTIVITY_FLUSH_SIZE,
+                 flush_interval=ACTIVITY_FLUSH_INTERVAL):
+        self.pool = pool
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"emitted": 0, "dropped": 0, "written": 0, "rejected": 0, "failed": 0, "flushes": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def emit(self, user_id: int, action: str, product_id: Optional[int] = None):
+        try:
+            self._queue.put_nowait((user_id, action, product_id, datetime.utcnow()))
+        except queue.Full:
+            self._count("dropped")
+            return
+        self._count("emitted")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+        # дописываем всё, что осталось в очереди к моменту остановки
+        while True:
+            batch = self._drain(self.flush_size)
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _collect(self):
+        deadline = time.monotonic() + self.flush_interval
+        batch = []
+        while len(batch) < self.flush_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+            batch.extend(self._drain(self.flush_size - len(batch)))
+        return batch
+
+    def _flush(self, batch):
+        user_ids, actions, product_ids, timestamps = (list(column) for column in zip(*batch))
+        try:
+            with self.pool.connection() as db, db.cursor() as cursor:
+                # события несуществующих пользователей/товаров отбрасываются, а не валят весь пакет
+                cursor.execute("""
+                    INSERT INTO user_logs (user_id, action, product_id, timestamp)
+                    SELECT e.user_id, e.action, e.product_id, e.ts
+                    FROM unnest(%s::int[], %s::text[], %s::int[], %s::timestamp[]) AS e(user_id, action, product_id, ts)
+                    WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = e.user_id)
+                      AND (e.product_id IS NULL OR EXISTS (SELECT 1 FROM products p WHERE p.id = e.product_id))
+                """, (user_ids, actions, product_ids, timestamps))
+                written = cursor.rowcount
+                db.commit()
+        except Exception:
+            logger.exception("Error writing activity events", extra={"events": len(batch)})
+            self._count("failed", len(batch))
+            return
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["written"] += written
+            self._stats["rejected"] += len(batch) - written
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(), "queue_size": self._queue.maxsize, **self._stats}
@@ -0,0 +1,181 @@
+"""Сводки продаж для отчётов администратора.
+
+Отчёты (GET /admin/analytics/*) читают дневные сводки sales_daily,
+sales_daily_category и sales_daily_product, поэтому их стоимость зависит от
+числа дней и категорий в периоде, а не от числа заказов.
+
+Сводки пополняются только новыми заказами. Каждый заказ хранит id создавшей
+его транзакции (orders.created_txid); проход берёт заказы от прошлой отметки
+до xmin текущего снимка. Все транзакции ниже xmin уже завершены, поэтому
+заказ, закоммиченный позже более нового, не теряется, и каждый заказ
+учитывается ровно один раз. Выручка относится к текущей категории товара.
+
+Обновление выполняет фоновый поток каждого воркера раз в
+ANALYTICS_REFRESH_INTERVAL секунд; advisory lock пропускает проход, если
+другой процесс уже обновляет сводки. Вручную:
+
+    python analytics.py            # учесть новые заказы
+    python analytics.py --rebuild  # пересчитать сводки с нуля
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+from database import DATABASE_URL
+
+
+logger = logging.getLogger(__name__)
+
+# 0 — фоновое обновление выключено (например, если сводки обновляет cron)
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "60"))
+ANALYTICS_LOCK_KEY = 7302154014
+
+ROLLUP_SQL = """
+    WITH batch AS (
+        SELECT o.id AS order_id, o.created_at::date AS day, oi.product_id,
+               COALESCE(p.category_id, 0) AS category_id, oi.quantity, oi.quantity * oi.price AS amount
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        WHERE o.created_txid >= %(last_txid)s AND o.created_txid < %(horizon)s
+        UNION ALL
+        -- заказы, созданные до миграции 0009
+        SELECT o.id, o.created_at::date, oi.product_id,
+               COALESCE(p.category_id, 0), oi.quantity, oi.quantity * oi.price
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        WHERE %(backfill)s AND o.created_txid IS NULL
+    ),
+    daily AS (
+        INSERT INTO sales_daily AS s (day, orders, units, revenue)
+        SELECT day, COUNT(DISTINCT order_id), SUM(quantity), SUM(amount)
+        FROM batch
+        GROUP BY day
+        ON CONFLICT (day) DO UPDATE
+            SET orders = s.orders + EXCLUDED.orders,
+                units = s.units + EXCLUDED.units,
+                revenue = s.revenue + EXCLUDED.revenue
+    ),
+    by_category AS (
+        INSERT INTO sales_daily_category AS s (day, category_id, orders, units, revenue)
+        SELECT day, category_id, COUNT(DISTINCT order_id), SUM(quantity), SUM(amount)
+        FROM batch
+        GROUP BY day, category_id
+        ON CONFLICT (day, category_id) DO UPDATE
+            SET orders = s.orders + EXCLUDED.orders,
+                units = s.units + EXCLUDED.units,
+                revenue = s.revenue + EXCLUDED.revenue
+    ),
+    by_product AS (
+        INSERT INTO sales_daily_product AS s (day, product_id, orders, units, revenue)
+        SELECT day, product_id, COUNT(DISTINCT order_id), SUM(quantity), SUM(amount)
+        FROM batch
+        WHERE product_id IS NOT NULL
+        GROUP BY day, product_id
+        ON CONFLICT (day, product_id) DO UPDATE
+            SET orders = s.orders + EXCLUDED.orders,
+                units = s.units + EXCLUDED.units,
+                revenue = s.revenue + EXCLUDED.revenue
+    )
+    SELECT COUNT(DISTINCT order_id), COUNT(*) FROM batch
+"""
+
+
+def refresh(conn, rebuild=False):
+    """Добавляет в сводки заказы после отметки; None, если обновление уже идёт."""
+    started = time.perf_counter()
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (ANALYTICS_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+
+        if rebuild:
+            cursor.execute("TRUNCATE sales_daily, sales_daily_category, sales_daily_product")
+            cursor.execute("UPDATE analytics_state SET last_txid = 0, backfilled = FALSE")
+        cursor.execute("SELECT last_txid, backfilled FROM analytics_state FOR UPDATE")
+        last_txid, backfilled = cursor.fetchone()
+        # транзакции ниже xmin завершены: их заказы уже видны и новых среди них не появится
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        horizon = cursor.fetchone()[0]
+
+        cursor.execute(ROLLUP_SQL, {"last_txid": last_txid, "horizon": horizon, "backfill": not backfilled})
+        orders, lines = cursor.fetchone()
+        cursor.execute(
+            "UPDATE analytics_state SET last_txid = %s, backfilled = TRUE, refreshed_at = NOW()",
+            (max(last_txid, horizon),),
+        )
+    conn.commit()
+    return {"orders": orders, "lines": lines, "seconds": round(time.perf_counter() - started, 3)}
+
+
+class RollupRefresher:
+    """Фоновое обновление сводок в процессе приложения."""
+
+    def __init__(self, pool, interval=ANALYTICS_REFRESH_INTERVAL):
+        self.pool = pool
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "skipped": 0, "failed": 0, "orders": 0, "last_run_seconds": 0.0}
+        self.refreshed_at = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        try:
+            with self.pool.connection() as db:
+                result = refresh(db)
+        except Exception:
+            logger.exception("Error refreshing sales rollups")
+            with self._lock:
+                self._stats["failed"] += 1
+            return None
+        with self._lock:
+            if result is None:
+                self._stats["skipped"] += 1
+            else:
+                self._stats["runs"] += 1
+                self._stats["orders"] += result["orders"]
+                self._stats["last_run_seconds"] = result["seconds"]
+                self.refreshed_at = time.monotonic()
+        return result
+
+    def stats(self):
+        with self._lock:
+            age = None if self.refreshed_at is None else round(time.monotonic() - self.refreshed_at, 3)
+            return {**self._stats, "seconds_since_refresh": age}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh sales rollups for admin analytics")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from all orders")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        result = refresh(conn, rebuild=args.rebuild)
+        print(result if result is not None else "Another rollup refresh is running, skipping")
+    finally:
+        conn.close()
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Load:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с TTL.
+
+    get_or_load гарантирует, что для одного ключа одновременно выполняется
+    не больше одной загрузки: остальные потоки ждут её результата.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=30.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._loading = {}
+        # растёт при каждой инвалидации, чтобы не сохранять результат
+        # загрузки, начатой до неё
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            load = self._loading.get(key)
+            owner = load is None
+            if owner:
+                load = self._loading[key] = _Load()
+                generation = self._generation
+
+        if not owner:
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.value
+
+        try:
+            load.value = loader()
+        except BaseException as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+                if load.error is None and generation == self._generation:
+                    self._store(key, load.value)
+            load.done.set()
+        return load.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
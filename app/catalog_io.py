@@ -0,0 +1,415 @@
+"""Потоковый импорт и экспорт каталога (товары и остатки) в CSV/NDJSON.
+
+Импорт читает файл построчно, проверяет каждую строку и передаёт годные в
+COPY во временную таблицу; затем одним запросом сливает их с products по
+name (последняя строка с тем же именем побеждает). Ошибочные строки не
+прерывают импорт, а попадают в отчёт с номером строки. Экспорт читает
+products серверным курсором порциями, поэтому память не зависит от размера
+каталога.
+
+    python catalog_io.py import feed.csv                 # товары
+    python catalog_io.py import stock.ndjson --kind stock
+    python catalog_io.py export --format ndjson > catalog.ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+
+from database import DATABASE_URL
+
+
+logger = logging.getLogger(__name__)
+
+# сколько строк обработать между вызовами on_progress
+IMPORT_PROGRESS_EVERY = int(os.getenv("IMPORT_PROGRESS_EVERY", "10000"))
+# больше ошибок в отчёт не попадает, но они по-прежнему считаются
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+CATALOG_IMPORT_LOCK_KEY = 7302154013
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+# столбцы файла для каждого вида импорта; первый — ключ слияния
+COLUMNS = {
+    "products": ("name", "description", "price", "stock", "category_id", "attributes"),
+    "stock": ("name", "stock"),
+}
+REQUIRED = {
+    "products": ("name", "price", "stock"),
+    "stock": ("name", "stock"),
+}
+
+STAGING_SQL = """
+    CREATE TEMP TABLE catalog_import (
+        line INT NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        description TEXT,
+        price DECIMAL(10, 2),
+        stock INT,
+        category_id INT,
+        attributes JSONB
+    ) ON COMMIT DROP
+"""
+
+MERGE_SQL = {
+    # ON CONFLICT по уникальному name не ломается, если товар с тем же именем создан
+    # параллельно (POST /products); xmax = 0 только у вставленной строки
+    "products": """
+        WITH merged AS (
+            INSERT INTO products (name, description, price, stock, category_id, attributes)
+            SELECT DISTINCT ON (name) name, description, price, stock, category_id, attributes
+            FROM catalog_import
+            ORDER BY name, line DESC
+            ON CONFLICT (name) DO UPDATE
+                SET description = EXCLUDED.description, price = EXCLUDED.price, stock = EXCLUDED.stock,
+                    category_id = EXCLUDED.category_id, attributes = EXCLUDED.attributes
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE NOT inserted) AS updated, COUNT(*) FILTER (WHERE inserted) AS inserted
+        FROM merged
+    """,
+    "stock": """
+        WITH latest AS (
+            SELECT DISTINCT ON (name) * FROM catalog_import ORDER BY name, line DESC
+        ), updated AS (
+            UPDATE products p SET stock = l.stock
+            FROM latest l
+            WHERE p.name = l.name
+            RETURNING p.id
+        )
+        SELECT (SELECT COUNT(*) FROM updated) AS updated, 0 AS inserted
+    """,
+}
+
+# строки, которые нельзя слить; удаляются из staging до слияния
+REJECT_SQL = {
+    "products": """
+        DELETE FROM catalog_import s
+        WHERE s.category_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.id = s.category_id)
+        RETURNING s.line, 'Unknown category_id ' || s.category_id AS error
+    """,
+    "stock": """
+        DELETE FROM catalog_import s
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.name = s.name)
+        RETURNING s.line, 'Unknown product ' || s.name AS error
+    """,
+}
+
+EXPORT_SQL = {
+    "products": "SELECT id, name, description, price, stock, category_id, attributes FROM products ORDER BY id",
+    "stock": "SELECT name, stock FROM products ORDER BY id",
+}
+
+
+def parse_records(stream, fmt):
+    """(номер строки, dict) для каждой записи; битая запись — (номер, исключение)."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        # битый заголовок (csv.Error) прерывает весь импорт — без него строки не разобрать
+        reader.fieldnames
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # NUL-байт, слишком длинное поле и т. п.: отклоняем запись, чтение идёт со следующей строки
+                yield reader.line_num, ValueError(f"Invalid CSV: {e}")
+                continue
+            # номер последней физической строки записи (поле может занимать несколько строк)
+            if None in record:
+                yield reader.line_num, ValueError("Too many fields")
+            else:
+                yield reader.line_num, record
+    elif fmt == "ndjson":
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f"Invalid JSON: {e}")
+                continue
+            if not isinstance(record, dict):
+                yield number, ValueError("Expected a JSON object")
+                continue
+            yield number, record
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _int(value, field):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+    if isinstance(value, float) and value != number:
+        raise ValueError(f"{field} must be an integer")
+    if not -2 ** 31 <= number < 2 ** 31:
+        raise ValueError(f"{field} is out of range")
+    return number
+
+
+def validate(record, kind):
+    """Приводит запись к кортежу столбцов staging; ValueError — строка отклоняется."""
+    for field in REQUIRED[kind]:
+        if _blank(record.get(field)):
+            raise ValueError(f"{field} is required")
+    name = str(record["name"]).strip()
+    if len(name) > 255:
+        raise ValueError("name is longer than 255 characters")
+    stock = _int(record["stock"], "stock")
+    if stock < 0:
+        raise ValueError("stock must not be negative")
+    if kind == "stock":
+        return name, None, None, stock, None, None
+
+    try:
+        price = Decimal(str(record["price"]))
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0 or price >= Decimal("1e8"):
+        raise ValueError("price must be between 0 and 99999999.99")
+    category_id = None if _blank(record.get("category_id")) else _int(record["category_id"], "category_id")
+    attributes = record.get("attributes")
+    if isinstance(attributes, str):
+        if not attributes.strip():
+            attributes = None
+        else:
+            try:
+                attributes = json.loads(attributes)
+            except ValueError:
+                raise ValueError("attributes must be a JSON object")
+    if attributes is not None and not isinstance(attributes, dict):
+        raise ValueError("attributes must be a JSON object")
+    description = record.get("description")
+    return (
+        name,
+        None if _blank(description) else str(description),
+        price.quantize(Decimal("0.01")),
+        stock,
+        category_id,
+        None if attributes is None else json.dumps(attributes, ensure_ascii=False),
+    )
+
+
+def _copy_text(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopySource(io.RawIOBase):
+    """Файлоподобный объект для COPY FROM, вычитывающий строки из генератора по мере надобности."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = b""
+        # psycopg2 заменяет исключение из read() своим QueryCanceled; исходное храним здесь
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines).encode()
+            except StopIteration:
+                break
+            except Exception as e:
+                self.error = e
+                raise
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.accepted = 0
+        self.updated = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def reject(self, line, error):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": str(error)})
+
+    def as_dict(self):
+        return {
+            "kind": self.kind,
+            "rows": self.rows,
+            "accepted": self.accepted,
+            "updated": self.updated,
+            "inserted": self.inserted,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
+
+
+def import_catalog(conn, stream, kind="products", fmt="csv", on_progress=None, before_commit=None):
+    """Импортирует текстовый поток stream одной транзакцией и возвращает отчёт.
+
+    before_commit(cursor) вызывается перед COMMIT — например, чтобы разослать
+    уведомление об изменении каталога в той же транзакции.
+    """
+    if kind not in COLUMNS:
+        raise ValueError(f"Unsupported import kind: {kind}")
+    report = ImportReport(kind)
+
+    def staging_lines():
+        for line, record in parse_records(stream, fmt):
+            report.rows += 1
+            if isinstance(record, Exception):
+                report.reject(line, record)
+            else:
+                try:
+                    values = validate(record, kind)
+                except ValueError as e:
+                    report.reject(line, e)
+                else:
+                    report.accepted += 1
+                    yield "\t".join(_copy_text(value) for value in (line,) + values) + "\n"
+            if on_progress is not None and report.rows % IMPORT_PROGRESS_EVERY == 0:
+                on_progress(report)
+
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            # один импорт за раз: параллельные слияния одних и тех же имён ждали бы друг друга построчно
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CATALOG_IMPORT_LOCK_KEY,))
+            cursor.execute(STAGING_SQL)
+            source = _CopySource(staging_lines())
+            try:
+                cursor.copy_expert(
+                    "COPY catalog_import (line, name, description, price, stock, category_id, attributes) FROM STDIN",
+                    source,
+                )
+            except psycopg2.Error:
+                # ошибка чтения файла (UnicodeDecodeError, csv.Error) — отдаём вызывающему её, а не QueryCanceled
+                if source.error is not None:
+                    raise source.error
+                raise
+            cursor.execute(REJECT_SQL[kind])
+            for line, error in cursor.fetchall():
+                report.accepted -= 1
+                report.reject(line, error)
+            report.errors.sort(key=lambda error: error["line"])
+            cursor.execute(MERGE_SQL[kind])
+            report.updated, report.inserted = cursor.fetchone()
+            if before_commit is not None:
+                before_commit(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if on_progress is not None:
+        on_progress(report)
+    logger.info("Catalog import finished", extra={key: value for key, value in report.as_dict().items() if key != "errors"})
+    return report
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def export_catalog(conn, kind="products", fmt="csv", batch_size=EXPORT_BATCH_SIZE, on_progress=None):
+    """Генератор строк выгрузки; читает products серверным курсором порциями по batch_size."""
+    if kind not in EXPORT_SQL:
+        raise ValueError(f"Unsupported export kind: {kind}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    exported = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    # psycopg2.extensions.cursor — кортежи, без построения словаря на каждую строку
+    with conn.cursor("catalog_export", cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(EXPORT_SQL[kind])
+        columns = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if columns is None:
+                columns = [column.name for column in cursor.description]
+                if fmt == "csv":
+                    writer.writerow(columns)
+            if not rows:
+                break
+            for row in rows:
+                if fmt == "csv":
+                    writer.writerow(
+                        json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else value
+                        for value in row
+                    )
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default))
+                    buffer.write("\n")
+            exported += len(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if on_progress is not None:
+                on_progress(exported)
+    if buffer.tell():
+        yield buffer.getvalue()
+    conn.rollback()
+    logger.info("Catalog export finished", extra={"kind": kind, "rows": exported})
+
+
+def detect_format(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk catalog import/export")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="merge a CSV/NDJSON file into products by name")
+    import_parser.add_argument("path", help="file to import, - for stdin")
+    import_parser.add_argument("--kind", choices=sorted(COLUMNS), default="products")
+    import_parser.add_argument("--format", choices=sorted(FORMATS))
+    export_parser = commands.add_parser("export", help="write the catalog to stdout")
+    export_parser.add_argument("--kind", choices=sorted(EXPORT_SQL), default="products")
+    export_parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.command == "import":
+            fmt = args.format or detect_format(args.path)
+            source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+            with source:
+                report = import_catalog(
+                    conn, source, args.kind, fmt,
+                    on_progress=lambda r: print(f"{r.rows} rows, {r.error_count} errors", file=sys.stderr),
+                    # тот же канал, что слушают воркеры приложения (main.CATALOG_CHANNEL)
+                    before_commit=lambda cursor: cursor.execute("SELECT pg_notify('catalog_changed', '')"),
+                )
+            print(json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
+        else:
+            for chunk in export_catalog(
+                conn, args.kind, args.format,
+                on_progress=lambda rows: print(f"{rows} rows", file=sys.stderr),
+            ):
+                sys.stdout.write(chunk)
+    finally:
+        conn.close()
@@ -0,0 +1,214 @@
+"""Лента изменений цен и остатков: GET /products/changes и поток SSE.
+
+Версия товара — id транзакции, последней его изменившей (см. миграцию
+0008). Курсор ленты не сдвигается дальше xmin снимка: транзакции с меньшими
+id уже завершены, а более поздние строки при следующем запросе придут ещё
+раз. Поэтому клиент может получить строку повторно, но не пропустит её.
+
+ChangeFeed держит один курсор на процесс. По уведомлению product_changes
+(одно LISTEN-соединение PgListener) он одним запросом читает изменения и
+раздаёт их всем подключённым SSE-клиентам; число запросов к базе не зависит
+от числа открытых браузеров.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_CHANGES_CHANNEL = "product_changes"
+PRODUCT_CHANGES_LIMIT = int(os.getenv("PRODUCT_CHANGES_LIMIT", "1000"))
+# SSE-поток /products/changes/stream (требует LISTEN-соединения на воркер)
+PRODUCT_CHANGES_STREAM = os.getenv("PRODUCT_CHANGES_STREAM", "0") == "1"
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# клиент, не успевающий читать столько событий, отключается и переподключится с Last-Event-ID
+SSE_CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", "100"))
+
+CHANGES_SQL = """
+    SELECT id, price::float8 AS price, stock, version
+    FROM products
+    WHERE version > %s
+    ORDER BY version, id
+    LIMIT %s
+"""
+
+
+def fetch_changes(cursor, since, limit=PRODUCT_CHANGES_LIMIT):
+    """{"items": [...], "version": курсор, "has_more": bool, "reset": bool}.
+
+    since=None — только текущая версия, без строк. reset=True — одна
+    транзакция изменила больше limit товаров; клиенту проще перечитать список.
+    Если курсор сдвинуть нельзя, возвращается пустой ответ с прежней версией.
+    """
+    # горизонт берётся до чтения строк: всё, что ниже него, к моменту чтения уже видно
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot()) AS horizon")
+    safe = cursor.fetchone()["horizon"] - 1
+    if since is None:
+        return {"items": [], "version": safe, "has_more": False, "reset": False}
+
+    cursor.execute(CHANGES_SQL, (since, limit + 1))
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    reset = False
+    if has_more:
+        # не разрываем транзакцию между страницами: курсор — это версия целиком
+        cut = rows[limit]["version"]
+        rows = [row for row in rows[:limit] if row["version"] != cut]
+        reset = not rows
+        version = min(cut if reset else rows[-1]["version"], safe)
+    else:
+        # всё после since прочитано — до горизонта новых строк уже не появится
+        version = safe
+    if version <= since:
+        # открытая транзакция держит xmin не выше since: курсор не сдвинуть, пока она не
+        # завершится, и повторный запрос вернул бы то же самое. Строки придут, когда горизонт
+        # сдвинется, — а до тех пор ждём следующего изменения, а не перечитываем их по кругу
+        return {"items": [], "version": since, "has_more": False, "reset": False}
+    return {"items": rows, "version": version, "has_more": has_more, "reset": reset}
+
+
+class ChangeFeed:
+    """Раздаёт изменения каталога SSE-клиентам текущего процесса."""
+
+    def __init__(self, connection_factory):
+        self.connection_factory = connection_factory
+        self.version = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.queries = 0
+        self.events = 0
+        self.dropped_clients = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # первый проход только запоминает текущую версию
+        self._wakeup.set()
+        self._thread = threading.Thread(target=self._run, name="product-changes", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close_streams()
+
+    def close_streams(self):
+        # завершаем открытые потоки, чтобы клиенты переподключились к другому воркеру
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, None)
+
+    def on_notify(self, payload):
+        # вызывается в потоке PgListener: только будим свой поток, запрос делает он
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._poll()
+            except Exception:
+                logger.exception("Error reading product changes")
+                self._stop.wait(1)
+                self._wakeup.set()
+
+    def _poll(self):
+        with self.connection_factory() as db, db.cursor() as cursor:
+            if self.version is None:
+                self.version = fetch_changes(cursor, None)["version"]
+                db.rollback()
+                return
+            while True:
+                since = self.version
+                result = fetch_changes(cursor, since)
+                self.queries += 1
+                self.version = result["version"]
+                if result["items"] or result["reset"]:
+                    self.publish(result)
+                # курсор не сдвинулся — дочитаем по следующему уведомлению
+                if not result["has_more"] or result["version"] == since:
+                    break
+            db.rollback()
+
+    def publish(self, result):
+        event = format_event(result)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        self.events += 1
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+    def _deliver(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # клиент не успевает: очищаем очередь и отключаем его (None завершает поток)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+            if event is not None:
+                self.dropped_clients += 1
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.add(entry)
+        return entry
+
+    def unsubscribe(self, entry):
+        with self._lock:
+            self._subscribers.discard(entry)
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._subscribers)
+        return {
+            "clients": clients,
+            "version": self.version or 0,
+            "queries": self.queries,
+            "events": self.events,
+            "dropped_clients": self.dropped_clients,
+        }
+
+
+def format_event(result):
+    name = "reset" if result["reset"] else "products"
+    return f"id: {result['version']}\nevent: {name}\ndata: {json.dumps(result['items'])}\n\n"
+
+
+async def event_stream(feed, entry, initial):
+    """События SSE: сначала догоняющая порция initial, затем рассылка feed.
+
+    Подписка entry оформляется до чтения initial, чтобы между ними ничего не потерялось.
+    """
+    queue = entry[1]
+    try:
+        yield f"retry: 3000\nid: {initial['version']}\n\n"
+        if initial["items"] or initial["reset"]:
+            yield format_event(initial)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if event is None:
+                break
+            yield event
+    finally:
+        feed.unsubscribe(entry)
@@ -0,0 +1,273 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from metrics import InstrumentedCursor
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db/shop")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# сколько секунд запрос ждёт свободное соединение, прежде чем получить 503
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# простаивающие дольше этого соединения (сверх min_size) закрываются
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+# соединение пересоздаётся после этого времени жизни
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+# соединение, простоявшее дольше этого, проверяется через SELECT 1 перед выдачей
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+# потоков threadpool на воркер: синхронные обработчики держат поток, пока ждут базу,
+# поэтому одновременно соединения пула занимают не больше THREADPOOL_SIZE запросов
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, check_idle=DB_POOL_CHECK_IDLE):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (min_size, max_size))
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+
+        self._cond = threading.Condition()
+        # свободные соединения: (conn, released_at); справа самые «тёплые»
+        self._idle = deque()
+        self._created_at = {}
+        self._checked_out_at = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = True
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._opened = 0
+        self._discarded = 0
+        self._failed_checks = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hold_total = 0.0
+        self._hold_max = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        now = time.monotonic()
+        with self._cond:
+            self._created_at[conn] = now
+            self._opened += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._created_at.pop(conn, None)
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def open(self):
+        with self._cond:
+            if not self._closed:
+                return
+            self._closed = False
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def _reap_idle(self, now):
+        # вызывается под self._cond; самые старые свободные соединения — слева
+        expired = []
+        while self._idle and self._size - len(expired) > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.max_idle:
+                break
+            self._idle.popleft()
+            expired.append(conn)
+        return expired
+
+    def _is_usable(self, conn, released_at, now):
+        if conn.closed:
+            return False
+        if now - self._created_at.get(conn, now) > self.max_lifetime:
+            return False
+        if now - released_at > self.check_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._failed_checks += 1
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            with self._cond:
+                expired = self._reap_idle(start)
+                entry = None
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            "No database connection available within %.1fs" % timeout
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            for conn in expired:
+                self._discard(conn)
+
+            if entry is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn, released_at = entry
+                if not self._is_usable(conn, released_at, time.monotonic()):
+                    self._discard(conn)
+                    continue
+
+            now = time.monotonic()
+            waited = now - start
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                self._checked_out_at[conn] = now
+            return conn
+
+    def putconn(self, conn):
+        now = time.monotonic()
+        with self._cond:
+            checked_out_at = self._checked_out_at.pop(conn, now)
+            held = now - checked_out_at
+            self._hold_total += held
+            self._hold_max = max(self._hold_max, held)
+
+        if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            # обработчик упал посреди транзакции — не отдаём её следующему запросу
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+
+        with self._cond:
+            expired = (
+                self._closed
+                or conn.closed
+                or now - self._created_at.get(conn, now) > self.max_lifetime
+            )
+            if not expired:
+                self._idle.append((conn, now))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def drain(self, timeout):
+        """Ждёт возврата всех выданных соединений; возвращает, сколько их ещё занято."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                in_use = len(self._checked_out_at)
+            remaining = deadline - time.monotonic()
+            if in_use == 0 or remaining <= 0:
+                return in_use
+            time.sleep(min(remaining, 0.1))
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "connections_opened": self._opened,
+                "connections_discarded": self._discarded,
+                "failed_health_checks": self._failed_checks,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+                "checkout_seconds_total": round(self._hold_total, 6),
+                "checkout_seconds_max": round(self._hold_max, 6),
+            }
+
+
+pool = ConnectionPool(DATABASE_URL)
+
+
+def get_db():
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
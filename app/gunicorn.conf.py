@@ -0,0 +1,51 @@
+"""Запуск в несколько процессов:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Мастер один раз загружает приложение (preload_app: импорт модулей, маршруты,
+страницы, правила ограничений) и применяет миграции, затем форкает
+WEB_CONCURRENCY воркеров uvicorn; загруженное состояние они получают через
+copy-on-write. Соединения с базой, фоновые потоки и LISTEN каждый воркер
+открывает сам в стартовом хуке — при импорте main к базе не обращается.
+
+По SIGTERM мастер пересылает сигнал воркерам и ждёт их не дольше
+GRACEFUL_TIMEOUT секунд (остановку воркера см. в lifecycle.py).
+"""
+import glob
+import multiprocessing
+import os
+import tempfile
+
+
+# до загрузки приложения: prometheus_client выбирает режим хранения метрик при импорте
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="shop-metrics-")
+for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+    os.remove(path)
+
+# миграции применяет мастер до fork; воркерам (и стартовому хуку) это уже не нужно
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+os.environ["MIGRATE_ON_STARTUP"] = "0"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '80')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+# больше SHUTDOWN_DRAIN_TIMEOUT, чтобы воркер успел дождаться оплат и закрыть пул
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+
+def on_starting(server):
+    if MIGRATE_ON_STARTUP:
+        import migrate
+
+        applied = migrate.run()
+        server.log.info("Applied %s migration(s)", len(applied))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него отдаём только gzip
+    brotli = None
+
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+# как часто (в секундах) проверять mtime HTML-страниц
+PAGE_RELOAD_INTERVAL = float(os.getenv("PAGE_RELOAD_INTERVAL", "1"))
+
+ENCODING_ETAG_SUFFIXES = ('-gzip"', '-br"')
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+class CachedBody:
+    """Готовое тело ответа с ETag и лениво сжатыми вариантами."""
+
+    def __init__(self, body: bytes, media_type: str, compress_level: int = 6):
+        self.body = body
+        self.media_type = media_type
+        self.etag = make_etag(body)
+        self.compress_level = compress_level
+        self._encoded = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=min(self.compress_level, 11))
+            else:
+                data = gzip.compress(self.body, compresslevel=min(self.compress_level, 9), mtime=0)
+            self._encoded[encoding] = data
+        return data
+
+    def etag_for(self, encoding) -> str:
+        """Строгий ETag своего представления: у сжатых вариантов другие байты — другой тег."""
+        if encoding is None:
+            return self.etag
+        return '%s-%s"' % (self.etag[:-1], encoding)
+
+
+def choose_encoding(request: Request, size: int):
+    if size < COMPRESS_MIN_SIZE:
+        return None
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # для If-None-Match используется слабое сравнение; тег любого варианта кодировки
+    # подходит — клиент мог закэшировать ответ, сжатый иначе
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        for suffix in ENCODING_ETAG_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)] + '"'
+                break
+        if tag == etag:
+            return True
+    return False
+
+
+def cached_response(request: Request, cached: CachedBody, cache_control: str = "no-cache") -> Response:
+    encoding = choose_encoding(request, len(cached.body))
+    headers = {"ETag": cached.etag_for(encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(cached.body, media_type=cached.media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(cached.encoded(encoding), media_type=cached.media_type, headers=headers)
+
+
+class StaticPage:
+    """HTML-файл в памяти; перечитывается с диска, только если изменился mtime."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._cached = None
+
+    def get(self) -> CachedBody:
+        now = time.monotonic()
+        if self._cached is not None and now - self._checked_at < PAGE_RELOAD_INTERVAL:
+            return self._cached
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if self._cached is None or mtime != self._mtime:
+                with open(self.path, "rb") as file:
+                    self._cached = CachedBody(file.read(), "text/html; charset=utf-8", compress_level=11)
+                self._mtime = mtime
+            self._checked_at = now
+            return self._cached
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import random
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# примерно раз в столько запросов удаляется порция просроченных ключей
+IDEMPOTENCY_PURGE_EVERY = int(os.getenv("IDEMPOTENCY_PURGE_EVERY", "1000"))
+MAX_KEY_LENGTH = 255
+
+
+def request_hash(payload) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def begin(cursor, scope: str, key: Optional[str], payload) -> Optional[JSONResponse]:
+    """Захватывает ключ в текущей транзакции.
+
+    Возвращает None, если запрос нужно выполнить (ключ не передан или
+    захвачен нами), либо сохранённый ответ для повтора. Если тот же ключ
+    сейчас обрабатывается другой транзакцией, INSERT ждёт её завершения на
+    уникальном индексе, поэтому дубликаты не выполняются параллельно.
+    """
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+    if IDEMPOTENCY_PURGE_EVERY > 0 and random.randrange(IDEMPOTENCY_PURGE_EVERY) == 0:
+        purge_expired(cursor)
+
+    digest = request_hash(payload)
+    cursor.execute("""
+        INSERT INTO idempotency_keys (scope, key, request_hash, expires_at)
+        VALUES (%s, %s, %s, NOW() + %s * INTERVAL '1 hour')
+        ON CONFLICT (scope, key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash,
+                status_code = NULL,
+                response = NULL,
+                created_at = NOW(),
+                expires_at = EXCLUDED.expires_at
+            WHERE idempotency_keys.expires_at < NOW()
+        RETURNING key
+    """, (scope, key, digest, IDEMPOTENCY_TTL_HOURS))
+    if cursor.fetchone() is not None:
+        return None
+
+    cursor.execute(
+        "SELECT request_hash, status_code, response FROM idempotency_keys WHERE scope = %s AND key = %s",
+        (scope, key),
+    )
+    stored = cursor.fetchone()
+    if stored["status_code"] is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    if stored["request_hash"] != digest:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return JSONResponse(
+        content=stored["response"],
+        status_code=stored["status_code"],
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def save(cursor, scope: str, key: Optional[str], response, status_code: int = 200):
+    # вызывается до COMMIT, чтобы ответ и изменения фиксировались атомарно
+    if key is None:
+        return
+    cursor.execute(
+        "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE scope = %s AND key = %s",
+        (status_code, json.dumps(jsonable_encoder(response)), scope, key),
+    )
+
+
+def purge_expired(cursor, batch_size: int = 1000):
+    cursor.execute("""
+        DELETE FROM idempotency_keys
+        WHERE ctid IN (
+            SELECT ctid FROM idempotency_keys WHERE expires_at < NOW() LIMIT %s
+        )
+    """, (batch_size,))
@@ -0,0 +1,66 @@
+"""Готовность воркера (/ready) и корректная остановка.
+
+Воркер готов, когда стартовый хук открыл пул. По SIGTERM/SIGINT он сразу
+перестаёт быть готовым (балансировщик снимает его с ротации) и вызывает
+колбэки on_drain — например, закрывает бесконечные SSE-потоки, иначе
+uvicorn ждал бы их до принудительного завершения. Затем uvicorn дожидается
+текущих запросов, и только после этого выполняется хук остановки, который
+ждёт возврата соединений пула (оплаты, ещё идущие в потоках threadpool) не
+дольше SHUTDOWN_DRAIN_TIMEOUT секунд.
+"""
+import asyncio
+import logging
+import os
+import signal
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# меньше graceful_timeout gunicorn (см. gunicorn.conf.py), чтобы успеть закрыть пул
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+# сколько /ready ждёт соединение из пула
+READY_POOL_TIMEOUT = float(os.getenv("READY_POOL_TIMEOUT", "1"))
+
+HANDLED_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class Lifecycle:
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self._on_drain = []
+
+    def on_drain(self, callback):
+        self._on_drain.append(callback)
+
+    def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        self.ready = False
+        logger.info("Draining worker", extra={"pid": os.getpid()})
+        for callback in self._on_drain:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error in drain callback")
+
+    def install_signal_handlers(self):
+        """Встраивается перед обработчиками сервера; вызывать из стартового хука в цикле событий."""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in HANDLED_SIGNALS:
+            previous = signal.getsignal(sig)
+
+            def handler(signum, frame, previous=previous):
+                # в обработчике сигнала нельзя брать блокировки — работа уходит в цикл событий
+                loop.call_soon_threadsafe(self.drain)
+                if callable(previous):
+                    previous(signum, frame)
+                elif previous == signal.SIG_DFL:
+                    signal.signal(signum, signal.SIG_DFL)
+                    signal.raise_signal(signum)
+
+            signal.signal(sig, handler)
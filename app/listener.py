@@ -0,0 +1,89 @@
+import logging
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+logger = logging.getLogger(__name__)
+
+
+class PgListener:
+    """Одно LISTEN-соединение на процесс, раздающее уведомления подписчикам.
+
+    Колбэки вызываются в потоке слушателя и должны быть быстрыми. После
+    переподключения каждый колбэк вызывается с payload=None: уведомления,
+    пришедшие во время разрыва, потеряны, и подписчик должен пересинхронизироваться.
+    """
+
+    def __init__(self, dsn, poll_interval=1.0, reconnect_delay=1.0):
+        self.dsn = dsn
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self._handlers = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.received = 0
+
+    def subscribe(self, channel, callback):
+        self._handlers.setdefault(channel, []).append(callback)
+
+    def start(self):
+        if self._thread is not None or not self._handlers:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 2)
+            self._thread = None
+
+    def _dispatch(self, channel, payload):
+        for callback in self._handlers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Error in %s listener", channel)
+
+    def _run(self):
+        first_connect = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    for channel in self._handlers:
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                self.connected = True
+                if not first_connect:
+                    for channel in self._handlers:
+                        self._dispatch(channel, None)
+                first_connect = False
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.received += 1
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                logger.warning("Listener connection error: %s", e)
+                first_connect = False
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
@@ -1,20 +1,63 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from pydantic import BaseModel
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, status
+from pydantic import BaseModel, Field, TypeAdapter
+from datetime import date, datetime, timedelta
+import csv
+import io
+import json
+import logging
 import os
+import random
+import tempfile
+import time
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
 from jose import JWTError, jwt
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+import anyio.to_thread
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2.extras import Json
 from typing import Optional, Dict, List
-
+import activity
+import analytics
+import catalog_io
+import changes
+import idempotency
+import lifecycle
+import metrics
+import migrate
+import passwords
+import ratelimit
+from cache import TTLCache
+from database import DATABASE_URL, THREADPOOL_SIZE, PoolClosed, PoolTimeout, get_db, pool
+from http_cache import COMPRESS_MIN_SIZE, CachedBody, StaticPage, cached_response
+from listener import PgListener
+from pagination import decode_cursor, encode_cursor
+from replicas import ReadRoutingMiddleware, get_read_db, read_connection, replicas
+
+
+logger = logging.getLogger("shop")
 
 app = FastAPI()
 
+
+def rate_limit_user(token):
+    """sub проверенного токена — ключ для правил ограничения с key=user."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+
+rate_limiter = ratelimit.RateLimiter(ratelimit.load_rules(), ratelimit.create_buckets(), rate_limit_user)
+
+if ratelimit.RATE_LIMIT_ENABLED:
+    # внутри CORS, чтобы ответ 429 тоже получал CORS-заголовки и был виден браузеру
+    app.add_middleware(ratelimit.RateLimitMiddleware, limiter=rate_limiter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -23,53 +66,201 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+
+if replicas:
+    app.add_middleware(ReadRoutingMiddleware)
+
+# последним, чтобы время ответа включало сжатие и остальные middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+PAGES = {
+    name: StaticPage(f"static/{name}.html")
+    for name in ("index", "login", "shop", "recommended", "checkout", "thank-you")
+}
+
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
-    with open("static/index.html", "r") as file:
-        return file.read()
+async def read_root(request: Request):
+    return cached_response(request, PAGES["index"].get())
 
 @app.get("/login", response_class=HTMLResponse)
-async def read_login():
-    with open("static/login.html", "r") as file:
-        return file.read()
+async def read_login(request: Request):
+    return cached_response(request, PAGES["login"].get())
     
 @app.get("/shop", response_class=HTMLResponse)
-async def read_shop():
-    with open("static/shop.html", "r") as file:
-        return file.read()
+async def read_shop(request: Request):
+    return cached_response(request, PAGES["shop"].get())
     
 @app.get("/recommended", response_class=HTMLResponse)
-async def read_recommended():
-    with open("static/recommended.html", "r") as file:
-        return file.read()
+async def read_recommended(request: Request):
+    return cached_response(request, PAGES["recommended"].get())
     
 @app.get("/checkout", response_class=HTMLResponse)
-async def read_checkout():
-    with open("static/checkout.html", "r") as file:
-        return file.read()
+async def read_checkout(request: Request):
+    return cached_response(request, PAGES["checkout"].get())
 
 @app.get("/thank-you", response_class=HTMLResponse)
-async def read_thank_you():
-    with open("static/thank-you.html", "r") as file:
-        return file.read()
+async def read_thank_you(request: Request):
+    return cached_response(request, PAGES["thank-you"].get())
+
+@app.exception_handler(passwords.PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many login attempts in progress, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
 
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+@app.exception_handler(PoolTimeout)
+@app.exception_handler(PoolClosed)
+async def pool_unavailable_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Database is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.get("/health", include_in_schema=False)
+async def health():
+    """Процесс жив и обслуживает цикл событий; базу не трогает."""
+    return {"status": "ok"}
+
+
+@app.get("/ready", include_in_schema=False)
+def ready():
+    """Воркер принимает трафик: запущен, не останавливается и получает соединение из пула."""
+    if not worker.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "draining" if worker.draining else "starting"},
+        )
     try:
-        yield conn
-    finally:
-        conn.close()
+        with pool.connection(lifecycle.READY_POOL_TIMEOUT) as db, db.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            db.rollback()
+    except (PoolTimeout, PoolClosed, psycopg2.Error) as e:
+        logger.warning("Readiness check failed: %s", e)
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "database unavailable"},
+        )
+    return {"status": "ready"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    body, media_type = metrics.render()
+    return Response(body, media_type=media_type)
+
+
+@app.get("/metrics/pool")
+def get_pool_metrics():
+    return pool.stats()
+
+
+@app.get("/metrics/replicas")
+def get_replica_metrics():
+    return replicas.stats()
+
+
+@app.get("/metrics/changes")
+def get_change_feed_metrics():
+    return product_changes.stats()
+
+
+@app.get("/metrics/ratelimit")
+def get_rate_limit_metrics():
+    return {"routes": rate_limiter.stats(), **rate_limiter.buckets.stats()}
+
+
+@app.get("/metrics/analytics")
+def get_analytics_metrics():
+    return sales_rollups.stats()
+
+
+@app.get("/metrics/passwords")
+def get_password_metrics():
+    return passwords.stats()
+
+
+@app.get("/metrics/activity")
+def get_activity_metrics():
+    return activity_log.stats()
+
+
+@app.get("/metrics/cache")
+def get_cache_metrics():
+    return {cache.name: cache.stats() for cache in (listing_cache, product_cache, principal_cache)}
 
 
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db/shop")
 SECRET_KEY = os.getenv("SECRET_KEY", "secret_key")  
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1024"))
+# рассылать инвалидацию кэша остальным воркерам через LISTEN/NOTIFY
+CATALOG_CACHE_NOTIFY = os.getenv("CATALOG_CACHE_NOTIFY", "0") == "1"
+CATALOG_CHANNEL = "catalog_changed"
+
+# кэши общие для всех клиентов и наполняются только с основного сервера: запись, загруженная
+# с отстающей реплики после инвалидации, продержалась бы весь TTL без новой инвалидации
+listing_cache = TTLCache("catalog_listings", CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+product_cache = TTLCache("products", CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+listener = PgListener(DATABASE_URL)
+activity_log = activity.ActivityLog(pool)
+sales_rollups = analytics.RollupRefresher(pool)
+worker = lifecycle.Lifecycle()
+# курсор ленты общий для всех клиентов, поэтому читает с основного сервера (см. get_product_changes)
+product_changes = changes.ChangeFeed(pool.connection)
+worker.on_drain(product_changes.close_streams)
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# токен -> пользователь; запись живёт не дольше самого токена
+principal_cache = TTLCache("principals", PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+metrics.register_stats("db_pool", pool.stats)
+if replicas:
+    metrics.register_stats("db_replica", lambda: {
+        name: {**stats, "healthy": int(stats["healthy"])}
+        for name, stats in replicas.stats()["replicas"].items()
+    }, label="replica")
+metrics.register_stats("passwords", passwords.stats)
+metrics.register_stats("activity", activity_log.stats)
+metrics.register_stats("analytics", sales_rollups.stats)
+metrics.register_stats("product_changes", product_changes.stats)
+metrics.register_stats("rate_limit", rate_limiter.stats, label="route")
+metrics.register_stats("rate_limit_backend", rate_limiter.buckets.stats)
+metrics.register_stats("cache", get_cache_metrics, label="cache")
+
+
+def invalidate_user(email: str):
+    principal_cache.invalidate_where(lambda token, user: user["email"] == email)
+
+
+def invalidate_catalog(product_id: Optional[int] = None):
+    listing_cache.clear()
+    if product_id is None:
+        product_cache.clear()
+    else:
+        product_cache.invalidate(product_id)
+
+
+def notify_catalog_changed(cursor, product_id: Optional[int] = None):
+    # уходит остальным воркерам при COMMIT текущей транзакции
+    if CATALOG_CACHE_NOTIFY:
+        cursor.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANNEL, "" if product_id is None else str(product_id)))
+
+
+def on_catalog_notify(payload: Optional[str]):
+    invalidate_catalog(int(payload) if payload else None)
 
 
 class UserCreate(BaseModel):
@@ -103,6 +294,11 @@ class CategoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CategoryTreeNode(BaseModel):
+    id: int
+    name: str
+    children: List["CategoryTreeNode"] = []
+
 class ProductCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -124,11 +320,36 @@ class ProductResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str]
+
+class CategoryFacet(BaseModel):
+    category_id: Optional[int]
+    name: Optional[str]
+    count: int
+
+class ProductSearchResult(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str]
+    total: int
+    facets: List[CategoryFacet]
+
+class ProductChange(BaseModel):
+    id: int
+    price: float
+    stock: int
+    version: int
+
+class ProductChanges(BaseModel):
+    items: List[ProductChange]
+    version: int
+    has_more: bool
+    reset: bool
+
 class CartItemCreate(BaseModel):
     product_id: int
-    quantity: int
-
-from pydantic import Field
+    quantity: int = Field(gt=0)  # прибавляется к количеству в корзине
 
 class CartItemResponse(BaseModel):
     id: int
@@ -141,6 +362,21 @@ class CartItemResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CartLineResponse(CartItemResponse):
+    subtotal: float
+
+class CartSummary(BaseModel):
+    items: List[CartLineResponse]
+    total_quantity: int
+    total_amount: float
+
+class CartLineUpdate(BaseModel):
+    product_id: int
+    quantity: int = Field(ge=0)  # 0 удаляет товар из корзины
+
+class CartBatchUpdate(BaseModel):
+    items: List[CartLineUpdate]
+
 class OrderCreate(BaseModel):
     user_id: int
     total_amount: float
@@ -168,89 +404,266 @@ class OrderItemResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class OrderLineResponse(BaseModel):
+    product_id: Optional[int]
+    name: Optional[str]
+    quantity: int
+    price: float
+
+class OrderDetailResponse(OrderResponse):
+    items: List[OrderLineResponse]
+
+class OrderPage(BaseModel):
+    items: List[OrderDetailResponse]
+    next_cursor: Optional[str]
+
+class DailySales(BaseModel):
+    day: date
+    orders: int
+    units: int
+    revenue: float
+
+class CategorySales(DailySales):
+    category_id: Optional[int]
+    category_name: Optional[str]
+
+class SalesReport(BaseModel):
+    date_from: date
+    date_to: date
+    refreshed_at: Optional[datetime]
+    totals: List[DailySales]
+    by_category: List[CategorySales]
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: str
+    orders: int
+    units: int
+    revenue: float
+
+class LowStockProduct(BaseModel):
+    id: int
+    name: str
+    stock: int
+    category_id: Optional[int]
+    units_sold: int
+    days_of_stock: Optional[float]
+
+
+def json_body(adapter: TypeAdapter, data) -> CachedBody:
+    return CachedBody(adapter.dump_json(adapter.validate_python(data)), "application/json")
+
+
+def json_array(rows, column: str = "api_json") -> str:
+    """Склеивает готовые JSON-объекты из столбца в массив без разбора и валидации."""
+    return "[" + ",".join(row[column] for row in rows) + "]"
+
+
+def product_list_body(rows, **fields) -> CachedBody:
+    """{"items": [...готовые товары...], **fields} — поля сериализуются обычным json.dumps."""
+    parts = ['{"items":', json_array(rows)]
+    for name, value in fields.items():
+        parts.append(f',"{name}":{json.dumps(value, default=str, ensure_ascii=False)}')
+    parts.append("}")
+    return CachedBody("".join(parts).encode(), "application/json")
+
+categories_adapter = TypeAdapter(List[CategoryResponse])
+category_tree_adapter = TypeAdapter(List[CategoryTreeNode])
+
 
 class PaymentInfo(BaseModel):
     pan: str  
     cvv: str  
     expiration_date: str  
     user_id: int  
-    total_amount: float  
+    total_amount: Optional[float] = None  # не используется: сумма заказа считается на сервере
 
 
-@app.post("/register", response_model=UserResponse)
-def register_user(user: UserCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    hashed_password = pwd_context.hash(user.password)
-    email = user.email.lower()
-    with db.cursor() as cursor:
+def insert_user(name: str, email: str, hashed_password: str):
+    with pool.connection() as db, db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO users (name, email, password, role) VALUES (%s, %s, %s, 'покупатель') RETURNING id, name, email, role, created_at",
-            (user.name, email, hashed_password),
+            (name, email, hashed_password),
         )
         new_user = cursor.fetchone()
         db.commit()
         return new_user
 
 
+def find_user_by_email(email: str):
+    with pool.connection() as db, db.cursor() as cursor:
+        cursor.execute("SELECT id, email, password FROM users WHERE email = %s", (email,))
+        return cursor.fetchone()
+
+
+def update_password_hash(user_id: int, hashed_password: str):
+    with pool.connection() as db, db.cursor() as cursor:
+        cursor.execute("UPDATE users SET password = %s WHERE id = %s", (hashed_password, user_id))
+        db.commit()
+
+
+@app.post("/register", response_model=UserResponse)
+async def register_user(user: UserCreate):
+    hashed_password = await passwords.hash_password(user.password)
+    email = user.email.lower()
+    new_user = await run_in_threadpool(insert_user, user.name, email, hashed_password)
+    invalidate_user(email)
+    return new_user
+
+
 @app.post("/login")
-def login_user(user: UserLogin, db: psycopg2.extensions.connection = Depends(get_db)):
+async def login_user(user: UserLogin):
     email = user.email.lower()
-    with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        db_user = cursor.fetchone()
-        if not db_user or not pwd_context.verify(user.password, db_user["password"]):
-            raise HTTPException(status_code=400, detail="Incorrect email or password")
-        
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": db_user["email"]}, expires_delta=access_token_expires
+    db_user = await run_in_threadpool(find_user_by_email, email)
+    if not db_user:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    valid, new_hash = await passwords.verify_and_update(user.password, db_user["password"])
+    if not valid:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash is not None:
+        # хеш со старым числом раундов — тихо пересчитываем, пароль пользователю менять не нужно
+        await run_in_threadpool(update_password_hash, db_user["id"], new_hash)
+        invalidate_user(email)
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": db_user["email"]}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer", "user_id": db_user["id"]}
+
+
+PURCHASE_MAX_RETRIES = int(os.getenv("PURCHASE_MAX_RETRIES", "3"))
+
+CHECKOUT_SQL = """
+    WITH cart_lines AS (
+        SELECT ci.product_id, SUM(ci.quantity)::int AS quantity
+        FROM cart_items ci
+        JOIN cart c ON ci.cart_id = c.id
+        WHERE c.user_id = %(user_id)s
+        GROUP BY ci.product_id
+    ),
+    reserved AS (
+        UPDATE products p
+        SET stock = p.stock - cl.quantity
+        FROM cart_lines cl
+        WHERE p.id = cl.product_id AND p.stock >= cl.quantity
+        RETURNING p.id AS product_id, cl.quantity, p.price
+    ),
+    new_order AS (
+        INSERT INTO orders (user_id, total_amount, status, payment_id, created_at)
+        SELECT %(user_id)s, SUM(r.quantity * r.price), 'в обработке', %(payment_id)s, %(created_at)s
+        FROM reserved r
+        HAVING COUNT(*) > 0 AND COUNT(*) = (SELECT COUNT(*) FROM cart_lines)
+        RETURNING id, total_amount
+    ),
+    new_items AS (
+        INSERT INTO order_items (order_id, product_id, quantity, price)
+        SELECT o.id, r.product_id, r.quantity, r.price
+        FROM new_order o CROSS JOIN reserved r
+    ),
+    cleared AS (
+        DELETE FROM cart_items
+        WHERE cart_id IN (SELECT id FROM cart WHERE user_id = %(user_id)s)
+          AND EXISTS (SELECT 1 FROM new_order)
+    )
+    SELECT
+        (SELECT id FROM new_order) AS order_id,
+        (SELECT total_amount FROM new_order) AS total_amount,
+        (SELECT COUNT(*) FROM cart_lines) AS line_count,
+        ARRAY(SELECT product_id FROM cart_lines EXCEPT SELECT product_id FROM reserved) AS unavailable,
+        ARRAY(SELECT product_id FROM reserved) AS reserved
+"""
+
+
+def checkout(cursor, user_id: int, payment_id: str):
+    # Покупки одного пользователя выполняются по очереди: следующая увидит уже пустую корзину
+    cursor.execute("SELECT id FROM cart WHERE user_id = %s ORDER BY id FOR UPDATE", (user_id,))
+    # Строки товаров блокируются в порядке id, чтобы встречные покупки не ловили deadlock
+    cursor.execute("""
+        SELECT p.id
+        FROM products p
+        WHERE p.id IN (
+            SELECT ci.product_id
+            FROM cart_items ci
+            JOIN cart c ON ci.cart_id = c.id
+            WHERE c.user_id = %s
         )
-        return {"access_token": access_token, "token_type": "bearer", "user_id": db_user["id"]}
+        ORDER BY p.id
+        FOR UPDATE
+    """, (user_id,))
+    cursor.execute(CHECKOUT_SQL, {"user_id": user_id, "payment_id": payment_id, "created_at": datetime.utcnow()})
+    return cursor.fetchone()
 
 
 @app.post("/purchase")
-async def create_purchase(payment_info: PaymentInfo, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/purchase")
-    try:
-        expiration_date = payment_info.expiration_date
-        if not expiration_date or len(expiration_date) != 5 or expiration_date[2] != '/':
-            raise HTTPException(status_code=400, detail="Invalid expiration date format. Use MM/YY.")
-
-        with db.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO orders (user_id, total_amount, status, payment_id, created_at) "
-                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (payment_info.user_id, payment_info.total_amount, 'в обработке', f"payment_{payment_info.pan[-4:]}", datetime.utcnow()),
-            )
-            order_id = cursor.fetchone()["id"]
-
-            cursor.execute("""
-                SELECT ci.product_id, ci.quantity, p.price
-                FROM cart_items ci
-                JOIN cart c ON ci.cart_id = c.id
-                JOIN products p ON ci.product_id = p.id
-                WHERE c.user_id = %s
-            """, (payment_info.user_id,))
-            cart_items = cursor.fetchall()
-
-            for item in cart_items:
-                cursor.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity, price) "
-                    "VALUES (%s, %s, %s, %s)",
-                    (order_id, item["product_id"], item["quantity"], item["price"]),
+def create_purchase(
+    payment_info: PaymentInfo,
+    idempotency_key: Optional[str] = Header(None),
+    db: psycopg2.extensions.connection = Depends(get_db),
+):
+    expiration_date = payment_info.expiration_date
+    if not expiration_date or len(expiration_date) != 5 or expiration_date[2] != '/':
+        raise HTTPException(status_code=400, detail="Invalid expiration date format. Use MM/YY.")
+    # попытка оформления логируется и тогда, когда заказ не состоится (пустая корзина, нет остатков)
+    activity_log.emit(payment_info.user_id, activity.STARTED_CHECKOUT)
+
+    scope = f"purchase:{payment_info.user_id}"
+    for attempt in range(PURCHASE_MAX_RETRIES):
+        try:
+            with db.cursor() as cursor:
+                replay = idempotency.begin(cursor, scope, idempotency_key, payment_info)
+                if replay is not None:
+                    db.rollback()
+                    return replay
+                result = checkout(cursor, payment_info.user_id, f"payment_{payment_info.pan[-4:]}")
+                if result["order_id"] is not None:
+                    response = {
+                        "detail": "Purchase successful!",
+                        "order_id": result["order_id"],
+                        "total_amount": float(result["total_amount"]),
+                    }
+                    idempotency.save(cursor, scope, idempotency_key, response)
+                    # остатки изменились — кэши каталога остальных воркеров сбрасываются при COMMIT
+                    for product_id in result["reserved"]:
+                        notify_catalog_changed(cursor, product_id)
+            if result["order_id"] is None:
+                db.rollback()
+                if result["line_count"] == 0:
+                    raise HTTPException(status_code=400, detail="Cart is empty")
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Not enough stock", "product_ids": sorted(result["unavailable"])},
                 )
-
-            cursor.execute("DELETE FROM cart_items WHERE cart_id IN (SELECT id FROM cart WHERE user_id = %s)", (payment_info.user_id,))
-
             db.commit()
+            break
+        except (psycopg2.errors.SerializationFailure, psycopg2.errors.DeadlockDetected) as e:
+            db.rollback()
+            logger.info("Purchase conflict, retrying", extra={"attempt": attempt + 1, "error": str(e)})
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        except HTTPException:
+            raise
+        except Exception:
+            db.rollback()
+            logger.exception("Error creating purchase")
+            raise HTTPException(status_code=500, detail="An error occurred while processing the purchase.")
+    else:
+        raise HTTPException(
+            status_code=409,
+            detail="Checkout conflicted with concurrent purchases, please retry.",
+            headers={"Retry-After": "1"},
+        )
 
-        return {"detail": "Purchase successful!", "order_id": order_id}
-    except Exception as e:
-        db.rollback()
-        print(f"Error creating purchase: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while processing the purchase.")
+    for product_id in result["reserved"]:
+        invalidate_catalog(product_id)
+    activity_log.emit(payment_info.user_id, activity.PLACED_ORDER)
+    return response
     
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: psycopg2.extensions.connection = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="Could not validate credentials",
@@ -263,21 +676,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: psycopg2.ext
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+    with pool.connection() as db, db.cursor() as cursor:
+        cursor.execute("SELECT id, name, email, role, created_at FROM users WHERE email = %s", (email,))
         user = cursor.fetchone()
-        if user is None:
-            raise credentials_exception
-        return user
+    if user is None:
+        raise credentials_exception
+    ttl = min(PRINCIPAL_CACHE_TTL, payload.get("exp", 0) - time.time())
+    if ttl > 0:
+        principal_cache.set(token, user, ttl=ttl)
+    return user
+
+
+ADMIN_ROLE = "администратор"
+
+
+def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != ADMIN_ROLE:
+        raise HTTPException(status_code=403, detail="Administrator role required")
+    return current_user
 
 
 @app.get("/users/me", response_model=UserResponse)
-def get_current_user(current_user: dict = Depends(get_current_user)):
+def read_current_user(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/users")
+def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
         cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
         user = cursor.fetchone()
@@ -288,151 +712,680 @@ def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)
 
 @app.post("/categories", response_model=CategoryResponse)
 def create_category(category: CategoryCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/categories create")
     with db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO categories (name, parent_id) VALUES (%s, %s) RETURNING id, name, parent_id",
             (category.name, category.parent_id),
         )
         new_category = cursor.fetchone()
+        notify_catalog_changed(cursor)
         db.commit()
-        return new_category
+    invalidate_catalog()
+    return new_category
     
 
 @app.get("/categories", response_model=List[CategoryResponse])
-def get_categories(db: psycopg2.extensions.connection = Depends(get_db)):
-    with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM categories")
-        categories = cursor.fetchall()
-        return categories
+def get_categories(request: Request):
+    def load():
+        with pool.connection() as db, db.cursor() as cursor:
+            cursor.execute("SELECT id, name, parent_id FROM categories")
+            return json_body(categories_adapter, cursor.fetchall())
+
+    return cached_response(request, listing_cache.get_or_load(("categories",), load))
+
+
+def build_category_tree(categories):
+    nodes = {category["id"]: {"id": category["id"], "name": category["name"], "children": []} for category in categories}
+    roots = []
+    for category in categories:
+        parent = nodes.get(category["parent_id"])
+        (parent["children"] if parent else roots).append(nodes[category["id"]])
+    return roots
+
+
+@app.get("/categories/tree", response_model=List[CategoryTreeNode])
+def get_category_tree(request: Request):
+    def load():
+        with pool.connection() as db, db.cursor() as cursor:
+            cursor.execute("SELECT id, name, parent_id FROM categories ORDER BY name, id")
+            return json_body(category_tree_adapter, build_category_tree(cursor.fetchall()))
+
+    return cached_response(request, listing_cache.get_or_load(("categories", "tree"), load))
 
 
 @app.post("/products", response_model=ProductResponse)
 def create_product(product: ProductCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/products create")
     with db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO products (name, description, price, stock, category_id, attributes, created_at) "
             "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id, name, description, price, stock, category_id, attributes, created_at",
-            (product.name, product.description, product.price, product.stock, product.category_id, product.attributes, datetime.utcnow()),
+            (product.name, product.description, product.price, product.stock, product.category_id,
+             Json(product.attributes) if product.attributes is not None else None, datetime.utcnow()),
         )
         new_product = cursor.fetchone()
+        notify_catalog_changed(cursor, new_product["id"])
         db.commit()
-        return new_product
+    invalidate_catalog(new_product["id"])
+    return new_product
     
 
-@app.get("/products", response_model=List[ProductResponse])
-def get_products(db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/products")
+def check_catalog_file(kind: str, format: str):
+    if kind not in catalog_io.COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unsupported kind: {kind}")
+    if format not in catalog_io.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+
+def run_catalog_import(file, kind: str, format: str):
+    file.seek(0)
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        with pool.connection() as db:
+            report = catalog_io.import_catalog(
+                db, stream, kind, format,
+                on_progress=lambda r: logger.info("Catalog import progress", extra={"rows": r.rows, "errors": r.error_count}),
+                before_commit=notify_catalog_changed,
+            )
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV header: {e}")
+    finally:
+        stream.close()
+    invalidate_catalog()
+    return report.as_dict()
+
+
+@app.post("/admin/catalog/import")
+async def import_catalog_file(
+    request: Request,
+    kind: str = "products",
+    format: str = "csv",
+    admin: dict = Depends(require_admin),
+):
+    """Тело запроса — файл целиком; он сначала сохраняется во временный файл, а не в память."""
+    check_catalog_file(kind, format)
+    file = tempfile.TemporaryFile()
+    try:
+        async for chunk in request.stream():
+            file.write(chunk)
+        return await run_in_threadpool(run_catalog_import, file, kind, format)
+    finally:
+        file.close()
+
+
+def stream_catalog_export(kind: str, format: str):
+    with read_connection() as db:
+        yield from catalog_io.export_catalog(db, kind, format)
+
+
+@app.get("/admin/catalog/export")
+def export_catalog_file(kind: str = "products", format: str = "csv", admin: dict = Depends(require_admin)):
+    check_catalog_file(kind, format)
+    return StreamingResponse(
+        stream_catalog_export(kind, format),
+        media_type=catalog_io.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
+
+
+# отчёты читают только сводки analytics.py: стоимость зависит от длины периода, а не от числа заказов
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 366
+PRODUCT_SALES_ORDER = {"units": "SUM(s.units)", "revenue": "SUM(s.revenue)"}
+
+
+def analytics_period(date_from: Optional[date], date_to: Optional[date]):
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (date_to - date_from).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Period must not exceed {ANALYTICS_MAX_DAYS} days")
+    return date_from, date_to
+
+
+@app.get("/admin/analytics/sales", response_model=SalesReport)
+def get_sales_report(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    admin: dict = Depends(require_admin),
+    db: psycopg2.extensions.connection = Depends(get_read_db),
+):
+    """Выручка по дням: итоги и разбивка по категориям (дни в UTC)."""
+    date_from, date_to = analytics_period(date_from, date_to)
+    with db.cursor() as cursor:
+        cursor.execute("SELECT refreshed_at FROM analytics_state")
+        state = cursor.fetchone()
+        cursor.execute("""
+            SELECT day, orders, units, revenue::float8 AS revenue
+            FROM sales_daily
+            WHERE day BETWEEN %s AND %s
+            ORDER BY day
+        """, (date_from, date_to))
+        totals = cursor.fetchall()
+        cursor.execute("""
+            SELECT s.day, NULLIF(s.category_id, 0) AS category_id, c.name AS category_name,
+                   s.orders, s.units, s.revenue::float8 AS revenue
+            FROM sales_daily_category s
+            LEFT JOIN categories c ON c.id = s.category_id
+            WHERE s.day BETWEEN %s AND %s
+            ORDER BY s.day, s.revenue DESC
+        """, (date_from, date_to))
+        by_category = cursor.fetchall()
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "refreshed_at": state["refreshed_at"] if state else None,
+        "totals": totals,
+        "by_category": by_category,
+    }
+
+
+@app.get("/admin/analytics/top-products", response_model=List[ProductSales])
+def get_top_products(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    order_by: str = "units",
+    limit: int = Query(10, ge=1, le=100),
+    admin: dict = Depends(require_admin),
+    db: psycopg2.extensions.connection = Depends(get_read_db),
+):
+    if order_by not in PRODUCT_SALES_ORDER:
+        raise HTTPException(status_code=400, detail=f"Unsupported order_by: {order_by}")
+    date_from, date_to = analytics_period(date_from, date_to)
     with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM products")
-        products = cursor.fetchall()
-        return products
+        cursor.execute(f"""
+            SELECT s.product_id, p.name, SUM(s.orders) AS orders, SUM(s.units) AS units,
+                   SUM(s.revenue)::float8 AS revenue
+            FROM sales_daily_product s
+            JOIN products p ON p.id = s.product_id
+            WHERE s.day BETWEEN %s AND %s
+            GROUP BY s.product_id, p.name
+            ORDER BY {PRODUCT_SALES_ORDER[order_by]} DESC, s.product_id
+            LIMIT %s
+        """, (date_from, date_to, limit))
+        return cursor.fetchall()
+
+
+@app.get("/admin/analytics/low-stock", response_model=List[LowStockProduct])
+def get_low_stock(
+    threshold: int = Query(10, ge=0),
+    days: int = Query(ANALYTICS_DEFAULT_DAYS, ge=1, le=ANALYTICS_MAX_DAYS),
+    limit: int = Query(50, ge=1, le=500),
+    admin: dict = Depends(require_admin),
+    db: psycopg2.extensions.connection = Depends(get_read_db),
+):
+    """Товары с остатком не больше threshold и на сколько дней его хватит при продажах последних days дней."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    with db.cursor() as cursor:
+        # остатки — по индексу (stock, id), продажи — по сводке конкретного товара
+        cursor.execute("""
+            SELECT p.id, p.name, p.stock, p.category_id, COALESCE(s.units, 0) AS units_sold,
+                   CASE WHEN s.units > 0 THEN round(p.stock * %(days)s::numeric / s.units, 1)::float8 END AS days_of_stock
+            FROM products p
+            LEFT JOIN LATERAL (
+                SELECT SUM(units) AS units
+                FROM sales_daily_product
+                WHERE product_id = p.id AND day >= %(since)s
+            ) s ON TRUE
+            WHERE p.stock <= %(threshold)s
+            ORDER BY p.stock, p.id
+            LIMIT %(limit)s
+        """, {"days": days, "since": since, "threshold": threshold, "limit": limit})
+        return cursor.fetchall()
+
+
+# поле сортировки -> тип для приведения значения из курсора
+PRODUCT_SORTS = {
+    "id": "int",
+    "price": "numeric",
+    "created_at": "timestamp",
+    "name": "text",
+}
+
+
+@app.get("/products", response_model=ProductPage)
+def get_products(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    category_id: Optional[int] = None,
+    include_descendants: bool = True,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    attributes: Optional[str] = None,
+):
+    descending = sort.startswith("-")
+    sort_field = sort.lstrip("-")
+    if sort_field not in PRODUCT_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+
+    conditions = []
+    params = []
+    if category_id is not None:
+        if include_descendants:
+            conditions.append("p.category_id IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = %s)")
+        else:
+            conditions.append("p.category_id = %s")
+        params.append(category_id)
+    if min_price is not None:
+        conditions.append("p.price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append("p.price <= %s")
+        params.append(max_price)
+    if attributes:
+        try:
+            attribute_filter = json.loads(attributes)
+        except ValueError:
+            attribute_filter = None
+        if not isinstance(attribute_filter, dict):
+            raise HTTPException(status_code=400, detail="attributes must be a JSON object")
+        conditions.append("p.attributes @> %s::jsonb")
+        params.append(json.dumps(attribute_filter))
+    if cursor:
+        cursor_sort, cursor_value, cursor_id = decode_cursor(cursor, "text", PRODUCT_SORTS[sort_field], "int")
+        if cursor_sort != sort:
+            raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+        if sort_field == "id":
+            conditions.append(f"p.id {'<' if descending else '>'} %s")
+            params.append(cursor_id)
+        else:
+            conditions.append(
+                f"(p.{sort_field}, p.id) {'<' if descending else '>'} (%s::{PRODUCT_SORTS[sort_field]}, %s)"
+            )
+            params.extend([cursor_value, cursor_id])
+
+    direction = "DESC" if descending else "ASC"
+    order_by = f"p.id {direction}" if sort_field == "id" else f"p.{sort_field} {direction}, p.id {direction}"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    sort_column = "" if sort_field == "id" else f", p.{sort_field}"
+    query = f"SELECT p.id{sort_column}, p.api_json FROM products p {where} ORDER BY {order_by} LIMIT %s"
+    params.append(limit + 1)
+
+    def load():
+        with pool.connection() as db, db.cursor() as cur:
+            cur.execute(query, params)
+            products = cur.fetchall()
+
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            next_cursor = encode_cursor([sort, last[sort_field], last["id"]])
+        return product_list_body(products, next_cursor=next_cursor)
+
+    return cached_response(request, listing_cache.get_or_load(("products", query, tuple(params)), load))
+
+
+@app.get("/products/changes", response_model=ProductChanges)
+def get_product_changes(
+    since: Optional[int] = None,
+    limit: int = Query(changes.PRODUCT_CHANGES_LIMIT, ge=1, le=changes.PRODUCT_CHANGES_LIMIT),
+    db: psycopg2.extensions.connection = Depends(get_db),
+):
+    """Цены и остатки товаров, изменившихся после версии since.
+
+    Без since возвращает только текущую версию. Читает с основного сервера:
+    горизонты разных реплик не согласованы, и курсор с одной из них мог бы
+    пропустить строки на другой.
+    """
+    check_changes_since(since)
+    with db.cursor() as cursor:
+        return changes.fetch_changes(cursor, since, limit)
+
+
+def check_changes_since(since: Optional[int]):
+    if since is not None and since < 0:
+        raise HTTPException(status_code=400, detail="since must not be negative")
+
+
+def initial_changes(since: Optional[int]):
+    with pool.connection() as db, db.cursor() as cursor:
+        result = changes.fetch_changes(cursor, since)
+        if result["has_more"]:
+            # клиент отстал больше чем на страницу — пусть перечитает список целиком
+            result = {**changes.fetch_changes(cursor, None), "reset": True}
+        return result
+
+
+@app.get("/products/changes/stream")
+async def stream_product_changes(request: Request, since: Optional[int] = None):
+    if not changes.PRODUCT_CHANGES_STREAM:
+        raise HTTPException(status_code=404, detail="Change stream is disabled")
+    if worker.draining:
+        # воркер останавливается — клиент переподключится к другому
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": "1"})
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    check_changes_since(since)
+    entry = product_changes.subscribe()
+    try:
+        initial = await run_in_threadpool(initial_changes, since)
+    except BaseException:
+        product_changes.unsubscribe(entry)
+        raise
+    return StreamingResponse(
+        changes.event_stream(product_changes, entry, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Совпадения по полнотекстовому индексу или по триграммам названия (опечатки);
+# оценка — ранг полнотекстового совпадения плюс похожесть названия на запрос
+SEARCH_MATCHES_SQL = """
+    SELECT p.id, p.category_id,
+           ts_rank_cd(p.search_vector, q.tsq)::float8 + similarity(p.name, %(q)s)::float8 AS score
+    FROM products p, websearch_to_tsquery('russian', %(q)s) AS q(tsq)
+    WHERE p.search_vector @@ q.tsq OR p.name %% %(q)s
+"""
+
+
+@app.get("/products/search", response_model=ProductSearchResult)
+def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    category_id: Optional[int] = None,
+):
+    params = {"q": q, "limit": limit + 1, "category_id": category_id, "cursor_score": None, "cursor_id": None}
+    if cursor:
+        params["cursor_score"], params["cursor_id"] = decode_cursor(cursor, "float", "int")
+
+    def load():
+        with pool.connection() as db, db.cursor() as cur:
+            cur.execute(f"""
+                WITH matches AS ({SEARCH_MATCHES_SQL})
+                SELECT p.id, p.api_json, m.score
+                FROM matches m
+                JOIN products p ON p.id = m.id
+                WHERE (%(category_id)s::int IS NULL OR m.category_id = %(category_id)s)
+                  AND (%(cursor_id)s::int IS NULL OR (m.score, m.id) < (%(cursor_score)s::float8, %(cursor_id)s::int))
+                ORDER BY m.score DESC, m.id DESC
+                LIMIT %(limit)s
+            """, params)
+            products = cur.fetchall()
+            # фасеты считаются без фильтра по категории, чтобы между категориями можно было переключаться
+            cur.execute(f"""
+                WITH matches AS ({SEARCH_MATCHES_SQL})
+                SELECT m.category_id, c.name, COUNT(*) AS count
+                FROM matches m
+                LEFT JOIN categories c ON c.id = m.category_id
+                GROUP BY m.category_id, c.name
+                ORDER BY count DESC, m.category_id
+            """, params)
+            facets = cur.fetchall()
+
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            next_cursor = encode_cursor([products[-1]["score"], products[-1]["id"]])
+        if category_id is None:
+            total = sum(facet["count"] for facet in facets)
+        else:
+            total = sum(facet["count"] for facet in facets if facet["category_id"] == category_id)
+        return product_list_body(products, next_cursor=next_cursor, total=total, facets=facets)
+
+    key = ("search", q, limit, cursor, category_id)
+    return cached_response(request, listing_cache.get_or_load(key, load))
+
+
+@app.get("/products/{product_id}", response_model=ProductResponse)
+def get_product(product_id: int, request: Request, user_id: Optional[int] = None):
+    def load():
+        with pool.connection() as db, db.cursor() as cursor:
+            cursor.execute("SELECT api_json FROM products WHERE id = %s", (product_id,))
+            product = cursor.fetchone()
+            return CachedBody(product["api_json"].encode(), "application/json") if product else None
+
+    product = product_cache.get_or_load(product_id, load)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if user_id is not None:
+        activity_log.emit(user_id, activity.VIEWED_PRODUCT, product_id)
+    return cached_response(request, product)
 
 
 @app.get("/recommendations", response_model=List[ProductResponse])
-async def get_recommendations(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/recommendations")
+def get_recommendations(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
         cursor.execute("""
-            SELECT p.*
+            SELECT p.api_json
             FROM recommendations r
             JOIN products p ON r.product_id = p.id
             WHERE r.user_id = %s
+            ORDER BY r.rank NULLS LAST, r.id
         """, (user_id,))
-        recommended_products = cursor.fetchall()
-        return recommended_products
+        return Response(json_array(cursor.fetchall()).encode(), media_type="application/json")
     
 
-@app.get("/cart", response_model=List[CartItemResponse])
-def get_cart(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart")
+CART_LINES_SQL = """
+    SELECT ci.id, ci.cart_id, ci.product_id, ci.quantity, p.name, p.price, ci.quantity * p.price AS subtotal
+    FROM cart_items ci
+    JOIN cart c ON ci.cart_id = c.id
+    JOIN products p ON ci.product_id = p.id
+    WHERE c.user_id = %s
+    ORDER BY ci.id
+"""
+
+# Корзина создаётся при первом обращении; DO UPDATE нужен, чтобы RETURNING вернул уже существующую
+USER_CART_CTE = """
+    user_cart AS (
+        INSERT INTO cart (user_id) VALUES (%(user_id)s)
+        ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+        RETURNING id
+    )
+"""
+
+
+def cart_summary(cursor, user_id: int):
+    cursor.execute(CART_LINES_SQL, (user_id,))
+    items = cursor.fetchall()
+    return {
+        "items": items,
+        "total_quantity": sum(item["quantity"] for item in items),
+        "total_amount": sum(item["subtotal"] for item in items),
+    }
+
+
+@app.get("/cart", response_model=List[CartLineResponse])
+def get_cart(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
-        cursor.execute("""
-            SELECT p.name, p.price, ci.id, ci.cart_id, ci.product_id, ci.quantity
-            FROM cart_items ci
-            JOIN cart c ON ci.cart_id = c.id
-            JOIN products p ON ci.product_id = p.id
-            WHERE c.user_id = %s
-        """, (user_id,))
-        cart_items = cursor.fetchall()
-        cart_items = [
-            {
-                'name': item['name'],
-                'price': float(item['price']),
-                'id': item['id'],
-                'cart_id': item['cart_id'],
-                'product_id': item['product_id'],
-                'quantity': item['quantity'],
-            }
-            for item in cart_items
-        ]
-        print(cart_items)
-        return cart_items
+        cursor.execute(CART_LINES_SQL, (user_id,))
+        return cursor.fetchall()
+
+
+@app.get("/cart/summary", response_model=CartSummary)
+def get_cart_summary(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
+    with db.cursor() as cursor:
+        return cart_summary(cursor, user_id)
+
+
+@app.post("/cart/items/batch", response_model=CartSummary)
+def update_cart_items(update: CartBatchUpdate, user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
+    # при повторе товара в одном запросе побеждает последнее значение
+    quantities = {line.product_id: line.quantity for line in update.items}
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(f"""
+                WITH {USER_CART_CTE},
+                changes AS (
+                    SELECT * FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS c(product_id, quantity)
+                ),
+                removed AS (
+                    DELETE FROM cart_items ci
+                    USING user_cart uc, changes c
+                    WHERE ci.cart_id = uc.id AND ci.product_id = c.product_id AND c.quantity = 0
+                )
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                SELECT uc.id, c.product_id, c.quantity
+                FROM user_cart uc, changes c
+                WHERE c.quantity > 0
+                ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = EXCLUDED.quantity
+            """, {"user_id": user_id, "product_ids": list(quantities), "quantities": list(quantities.values())})
+            summary = cart_summary(cursor, user_id)
+        db.commit()
+    except psycopg2.errors.ForeignKeyViolation:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User or product not found")
+    for product_id, quantity in quantities.items():
+        activity_log.emit(user_id, activity.ADDED_TO_CART if quantity else activity.REMOVED_FROM_CART, product_id)
+    return summary
+
 
 @app.post("/cart/items", response_model=CartItemResponse)
-def add_cart_item(item: CartItemCreate, user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart/items")
+def add_cart_item(
+    item: CartItemCreate,
+    user_id: int,
+    idempotency_key: Optional[str] = Header(None),
+    db: psycopg2.extensions.connection = Depends(get_db),
+):
+    scope = f"cart_items:{user_id}"
     with db.cursor() as cursor:
-        cursor.execute("SELECT id FROM cart WHERE user_id = %s", (user_id,))
-        cart = cursor.fetchone()
-        if not cart:
-            cursor.execute("INSERT INTO cart (user_id, created_at) VALUES (%s, NOW()) RETURNING id", (user_id,))
-            cart = cursor.fetchone()
-        
-        cursor.execute("""
-            INSERT INTO cart_items (cart_id, product_id, quantity)
-            VALUES (%s, %s, %s)
-            RETURNING id, cart_id, product_id, quantity
-        """, (cart["id"], item.product_id, item.quantity))
+        replay = idempotency.begin(cursor, scope, idempotency_key, item)
+        if replay is not None:
+            db.rollback()
+            return replay
+
+        # повторное добавление того же товара увеличивает количество, а не создаёт новую строку
+        try:
+            cursor.execute(f"""
+                WITH {USER_CART_CTE},
+                upserted AS (
+                    INSERT INTO cart_items (cart_id, product_id, quantity)
+                    SELECT id, %(product_id)s, %(quantity)s FROM user_cart
+                    ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+                    RETURNING id, cart_id, product_id, quantity
+                )
+                SELECT u.id, u.cart_id, u.product_id, u.quantity, p.name, p.price
+                FROM upserted u
+                JOIN products p ON p.id = u.product_id
+            """, {"user_id": user_id, "product_id": item.product_id, "quantity": item.quantity})
+        except psycopg2.errors.ForeignKeyViolation:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="User or product not found")
         new_item = cursor.fetchone()
-        
-        cursor.execute("SELECT name, price FROM products WHERE id = %s", (new_item["product_id"],))
-        product = cursor.fetchone()
-        
-        new_item_with_product = {
-            **new_item,
-            "name": product["name"],
-            "price": float(product["price"])
-        }
-        
+
+        idempotency.save(cursor, scope, idempotency_key, CartItemResponse.model_validate(new_item))
         db.commit()
-        return new_item_with_product
+    activity_log.emit(user_id, activity.ADDED_TO_CART, item.product_id)
+    return new_item
     
 
 @app.delete("/cart/items/{cart_item_id}")
 def remove_cart_item(cart_item_id: int, user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart/items/delete")
     with db.cursor() as cursor:
         cursor.execute("""
-            SELECT ci.id
-            FROM cart_items ci
-            JOIN cart c ON ci.cart_id = c.id
-            WHERE ci.id = %s AND c.user_id = %s
+            DELETE FROM cart_items ci
+            USING cart c
+            WHERE ci.id = %s AND ci.cart_id = c.id AND c.user_id = %s
+            RETURNING ci.product_id
         """, (cart_item_id, user_id))
         item = cursor.fetchone()
         if not item:
             raise HTTPException(status_code=404, detail="Cart item not found")
-        
-        cursor.execute("DELETE FROM cart_items WHERE id = %s", (cart_item_id,))
         db.commit()
+    activity_log.emit(user_id, activity.REMOVED_FROM_CART, item["product_id"])
     return {"detail": "Cart item removed successfully"}
 
 
 @app.post("/orders", response_model=OrderResponse)
-def create_order(order: OrderCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/orders")
+def create_order(
+    order: OrderCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db: psycopg2.extensions.connection = Depends(get_db),
+):
+    scope = f"orders:{order.user_id}"
     with db.cursor() as cursor:
+        replay = idempotency.begin(cursor, scope, idempotency_key, order)
+        if replay is not None:
+            db.rollback()
+            return replay
+
         cursor.execute(
             "INSERT INTO orders (user_id, total_amount, status, payment_id, created_at) "
             "VALUES (%s, %s, %s, %s, %s) RETURNING id, user_id, total_amount, status, payment_id, created_at",
             (order.user_id, order.total_amount, order.status, order.payment_id, datetime.utcnow()),
         )
         new_order = cursor.fetchone()
+        idempotency.save(cursor, scope, idempotency_key, OrderResponse.model_validate(new_order))
         db.commit()
         return new_order
     
 
+# заказ вместе с позициями одним JSON-объектом; ::text — чтобы psycopg2 не разбирал JSON,
+# а ответ собирался из готовых строк без повторной сериализации
+ORDER_DETAIL_SQL = """
+    SELECT o.created_at, o.id, json_build_object(
+        'id', o.id,
+        'user_id', o.user_id,
+        'total_amount', o.total_amount,
+        'status', o.status,
+        'payment_id', o.payment_id,
+        'created_at', o.created_at,
+        'items', COALESCE((
+            SELECT json_agg(json_build_object(
+                'product_id', oi.product_id,
+                'name', p.name,
+                'quantity', oi.quantity,
+                'price', oi.price
+            ) ORDER BY oi.id)
+            FROM order_items oi
+            LEFT JOIN products p ON p.id = oi.product_id
+            WHERE oi.order_id = o.id
+        ), '[]')
+    )::text AS body
+    FROM orders o
+"""
+
+
+@app.get("/orders", response_model=OrderPage)
+def get_orders(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: psycopg2.extensions.connection = Depends(get_read_db),
+):
+    conditions = ["o.user_id = %s"]
+    params = [user_id]
+    if cursor is not None:
+        created_at, order_id = decode_cursor(cursor, "timestamp", "int")
+        conditions.append("(o.created_at, o.id) < (%s::timestamp, %s::int)")
+        params.extend([created_at, order_id])
+    with db.cursor() as cur:
+        cur.execute(
+            f"{ORDER_DETAIL_SQL} WHERE {' AND '.join(conditions)} "
+            "ORDER BY o.created_at DESC, o.id DESC LIMIT %s",
+            params + [limit + 1],
+        )
+        rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["created_at"].isoformat(), rows[-1]["id"]])
+    body = '{"items":[%s],"next_cursor":%s}' % (",".join(row["body"] for row in rows), json.dumps(next_cursor))
+    return Response(body.encode(), media_type="application/json")
+
+
+@app.get("/orders/{order_id}", response_model=OrderDetailResponse)
+def get_order(order_id: int, user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
+    with db.cursor() as cursor:
+        cursor.execute(f"{ORDER_DETAIL_SQL} WHERE o.id = %s AND o.user_id = %s", (order_id, user_id))
+        row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return Response(row["body"].encode(), media_type="application/json")
+
+
 def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -441,298 +1394,44 @@ def create_access_token(data: dict, expires_delta: timedelta):
     return encoded_jwt
 
 
-@app.on_event("startup")
-def startup_event():
-    db = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-    try:
-        # pass
-        
-        drop_all_tables(db)
-        create_tables(db)
-        insert_sample_data(db)
-    finally:
-        db.close()
-
-
-def drop_all_tables(db: psycopg2.extensions.connection):
-    try:
-        with db.cursor() as cursor:
-            cursor.execute(
-            """
-                DROP TABLE IF EXISTS users CASCADE;
-                DROP TABLE IF EXISTS categories CASCADE;
-                DROP TABLE IF EXISTS products CASCADE;
-                DROP TABLE IF EXISTS cart CASCADE;
-                DROP TABLE IF EXISTS cart_items CASCADE;
-                DROP TABLE IF EXISTS orders CASCADE;
-                DROP TABLE IF EXISTS order_items CASCADE;
-                DROP TABLE IF EXISTS user_logs CASCADE;
-                DROP TABLE IF EXISTS recommendations CASCADE;
-            """)
-    except Exception as e:
-        db.rollback()
-        print(f"Error dropping tables: {e}")
-
-
-def create_tables(db: psycopg2.extensions.connection):
-    try:
-        with db.cursor() as cursor:
-
-            
-            cursor.execute("""
-                CREATE TABLE users (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    role VARCHAR(50) NOT NULL CHECK (role IN ('покупатель', 'администратор')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL UNIQUE,  -- Add UNIQUE constraint
-                    parent_id INT REFERENCES categories(id) ON DELETE SET NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS products (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL UNIQUE,  -- Add UNIQUE constraint
-                    description TEXT,
-                    price DECIMAL(10, 2) NOT NULL CHECK (price >= 0),
-                    stock INT NOT NULL CHECK (stock >= 0),
-                    category_id INT REFERENCES categories(id) ON DELETE SET NULL,
-                    attributes JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS cart (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS cart_items (
-                    id SERIAL PRIMARY KEY,
-                    cart_id INT REFERENCES cart(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    quantity INT NOT NULL CHECK (quantity > 0)
-                );
-
-                CREATE TABLE IF NOT EXISTS orders (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    total_amount DECIMAL(10, 2) NOT NULL CHECK (total_amount >= 0),
-                    status VARCHAR(50) NOT NULL CHECK (status IN ('в обработке', 'отправлен', 'доставлен')),
-                    payment_id VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS order_items (
-                    id SERIAL PRIMARY KEY,
-                    order_id INT REFERENCES orders(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    quantity INT NOT NULL CHECK (quantity > 0),
-                    price DECIMAL(10, 2) NOT NULL CHECK (price >= 0)
-                );
-
-                CREATE TABLE IF NOT EXISTS user_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    action VARCHAR(255) NOT NULL,
-                    product_id INT REFERENCES products(id) ON DELETE SET NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS recommendations (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            db.commit()
-            print("Tables created successfully!")
-    except Exception as e:
-        db.rollback()
-        print(f"Error creating tables: {e}")
-
-
-def insert_sample_data(db: psycopg2.extensions.connection):
-    print("Inserting sample data into categories and products...")
-    cursor = db.cursor()
-    try:
-        cursor.execute("""
-            -- Заполнение таблицы пользователей
-            INSERT INTO users (name, email, password, role)
-            VALUES
-                ('Иван Иванов', 'ivanov@example.com', %s, 'покупатель'),
-                ('Мария Петрова', 'petrova@example.com', %s, 'покупатель'),
-                ('Алексей Сидоров', 'sidorov@example.com', %s, 'администратор'),
-                ('Наталья Смирнова', 'smirnova@example.com', %s, 'покупатель'),
-                ('Дмитрий Кузнецов', 'kuznetsov@example.com', %s, 'покупатель'),
-                ('Ольга Васильева', 'vasilieva@example.com', %s, 'покупатель'),
-                ('Екатерина Зайцева', 'zaytseva@example.com', %s, 'покупатель'),
-                ('Игорь Беляев', 'belyaev@example.com', %s, 'покупатель'),
-                ('Марина Орлова', 'orlova@example.com', %s, 'покупатель'),
-                ('Юрий Михайлов', 'mikhaylov@example.com', %s, 'администратор'),
-                ('Татьяна Федорова', 'fedorova@example.com', %s, 'покупатель'),
-                ('Константин Соловьев', 'solovyov@example.com', %s, 'покупатель')
-            ON CONFLICT (email) DO NOTHING;
-        """, (pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123")))
-
-        
-        cursor.execute("""
-            INSERT INTO categories (name, parent_id)
-            VALUES
-                ('Электроника', NULL),
-                ('Одежда', NULL),
-                ('Обувь', NULL),
-                ('Товары для дома', NULL),
-                ('Товары для детей', NULL)
-            ON CONFLICT (name) DO NOTHING;
-        """)
-
-        
-        cursor.execute("""
-            SELECT id, name FROM categories WHERE name IN (
-                'Электроника', 'Одежда', 'Обувь', 'Товары для дома', 'Товары для детей'
-            );
-        """)
-        parent_categories = {row['name']: row['id'] for row in cursor.fetchall()}
-
-        
-        cursor.execute("""
-            INSERT INTO categories (name, parent_id)
-            VALUES
-                ('Компьютеры', %(electronics_id)s),
-                ('Смартфоны', %(electronics_id)s),
-                ('Телевизоры', %(electronics_id)s),
-                ('Мужская одежда', %(clothing_id)s),
-                ('Женская одежда', %(clothing_id)s),
-                ('Спортивная обувь', %(shoes_id)s),
-                ('Повседневная обувь', %(shoes_id)s),
-                ('Мебель', %(home_goods_id)s),
-                ('Декор', %(home_goods_id)s),
-                ('Кухня', %(home_goods_id)s),
-                ('Игрушки', %(kids_goods_id)s),
-                ('Детская одежда', %(kids_goods_id)s)
-            ON CONFLICT (name) DO NOTHING;
-        """, {
-            'electronics_id': parent_categories['Электроника'],
-            'clothing_id': parent_categories['Одежда'],
-            'shoes_id': parent_categories['Обувь'],
-            'home_goods_id': parent_categories['Товары для дома'],
-            'kids_goods_id': parent_categories['Товары для детей']
-        })
-
-        
-        cursor.execute("SELECT id, name FROM categories;")
-        categories = {row['name']: row['id'] for row in cursor.fetchall()}
-
-        
-        cursor.execute("""
-            INSERT INTO products (name, description, price, stock, category_id, attributes)
-            VALUES
-                ('Ноутбук', 'Мощный ноутбук для работы и игр', 50000.00, 10, %(computers_id)s, '{"color": "черный", "processor": "Intel i7", "ram": "16GB"}'),
-                ('Смартфон', 'Современный смартфон с отличной камерой', 25000.00, 15, %(smartphones_id)s, '{"color": "белый", "camera": "12MP", "battery": "4000mAh"}'),
-                ('Телевизор', 'Ультра HD телевизор с поддержкой Smart TV', 35000.00, 8, %(tvs_id)s, '{"size": "55 inch", "type": "LED", "resolution": "4K"}'),
-                ('Футболка', 'Стильная мужская футболка', 1500.00, 50, %(mens_clothing_id)s, '{"size": "M", "color": "синий"}'),
-                ('Платье', 'Элегантное платье для особых случаев', 3000.00, 30, %(womens_clothing_id)s, '{"size": "S", "color": "красный"}'),
-                ('Кроссовки', 'Удобные кроссовки для спорта', 4000.00, 25, %(sports_shoes_id)s, '{"size": "42", "color": "черный"}'),
-                ('Сандалии', 'Летние сандалии для отдыха', 2000.00, 40, %(casual_shoes_id)s, '{"size": "38", "color": "бежевый"}'),
-                ('Кресло', 'Удобное кресло для офиса', 8000.00, 15, %(furniture_id)s, '{"color": "черный", "material": "кожа"}'),
-                ('Кровать', 'Комфортная двуспальная кровать с матрасом', 25000.00, 20, %(furniture_id)s, '{"material": "дерево", "size": "King"}'),
-                ('Игрушечный робот', 'Интерактивный робот для детей', 1500.00, 50, %(toys_id)s, '{"battery": "AA", "color": "красный"}'),
-                ('Детская футболка', 'Яркая футболка для детей', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "голубой"}'),
-                ('aaaaa', 'sadf', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "blue"}')
-            ON CONFLICT (name) DO NOTHING;
-        """, {
-            'computers_id': categories['Компьютеры'],
-            'smartphones_id': categories['Смартфоны'],
-            'tvs_id': categories['Телевизоры'],
-            'mens_clothing_id': categories['Мужская одежда'],
-            'womens_clothing_id': categories['Женская одежда'],
-            'sports_shoes_id': categories['Спортивная обувь'],
-            'casual_shoes_id': categories['Повседневная обувь'],
-            'furniture_id': categories['Мебель'],
-            'toys_id': categories['Игрушки'],
-            'kids_clothing_id': categories['Детская одежда']
-        })
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
 
-        cursor.execute("""
-                -- Заполнение таблицы корзин
-                INSERT INTO cart (user_id)
-                VALUES
-                    (1), (2), (3), (4), (5),
-                    (6), (7), (8), (9), (10);
-
-                -- Заполнение таблицы товаров в корзине
-                INSERT INTO cart_items (cart_id, product_id, quantity)
-                VALUES
-                    (1, 1, 1), (1, 2, 2), (2, 3, 1), (2, 4, 3), (3, 5, 1),
-                    (3, 6, 1), (4, 7, 1), (4, 8, 2), (5, 9, 1), (6, 10, 1),
-                    (7, 11, 2), (8, 12, 1);
-
-                -- Заполнение таблицы заказов
-                INSERT INTO orders (user_id, total_amount, status, payment_id)
-                VALUES
-                    (1, 55000.00, 'в обработке', 'payment_1'),
-                    (2, 70000.00, 'отправлен', 'payment_2'),
-                    (3, 30000.00, 'доставлен', 'payment_3'),
-                    (4, 12000.00, 'в обработке', 'payment_4'),
-                    (5, 10000.00, 'отправлен', 'payment_5'),
-                    (6, 8000.00, 'доставлен', 'payment_6'),
-                    (7, 25000.00, 'в обработке', 'payment_7'),
-                    (8, 20000.00, 'отправлен', 'payment_8'),
-                    (9, 15000.00, 'доставлен', 'payment_9'),
-                    (10, 40000.00, 'в обработке', 'payment_10');
-
-                -- Заполнение таблицы товаров в заказе
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES
-                    (1, 1, 1, 50000.00), (1, 2, 2, 1500.00),
-                    (2, 3, 1, 35000.00), (2, 4, 3, 1500.00),
-                    (3, 5, 1, 3000.00), (3, 6, 1, 4000.00),
-                    (4, 7, 1, 2000.00), (4, 8, 2, 1000.00),
-                    (5, 9, 1, 8000.00), (6, 10, 1, 1500.00),
-                    (7, 11, 2, 1500.00), (8, 12, 1, 12000.00);
-
-                -- Заполнение таблицы логов пользователей
-                INSERT INTO user_logs (user_id, action, product_id)
-                VALUES
-                    (1, 'Добавил товар в корзину', 1), (1, 'Перешел к оформлению заказа', NULL),
-                    (2, 'Просмотрел товар', 3), (2, 'Добавил товар в корзину', 4),
-                    (3, 'Удалил товар из корзины', 5), (4, 'Перешел к оформлению заказа', NULL),
-                    (5, 'Добавил товар в корзину', 7), (6, 'Просмотрел товар', 9),
-                    (7, 'Добавил товар в корзину', 11), (8, 'Удалил товар из корзины', 12);
-
-                -- Заполнение таблицы рекомендаций
-                INSERT INTO recommendations (user_id, product_id)
-                VALUES
-                    (1, 2), (1, 3), (2, 4), (3, 5),
-                    (4, 6), (5, 7), (6, 8), (7, 9),
-                    (8, 10), (9, 11), (10, 12);
-""")
 
-        db.commit()
-        print("Sample data inserted successfully!")
-    except Exception as e:
-        print(f"Error inserting sample data: {e}")
-    finally:
-        cursor.close()
\ No newline at end of file
+@app.on_event("startup")
+def startup_event():
+    metrics.configure_logging()
+    if MIGRATE_ON_STARTUP:
+        migrate.run(DATABASE_URL)
+    # синхронные обработчики выполняются в threadpool anyio; его размер — потолок параллельных запросов к базе
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # пул открывается в каждом воркере после fork: соединения нельзя делить между процессами
+    pool.open()
+    replicas.open()
+    activity_log.start()
+    sales_rollups.start()
+    if CATALOG_CACHE_NOTIFY:
+        listener.subscribe(CATALOG_CHANNEL, on_catalog_notify)
+    if changes.PRODUCT_CHANGES_STREAM:
+        listener.subscribe(changes.PRODUCT_CHANGES_CHANNEL, product_changes.on_notify)
+        product_changes.start()
+    listener.start()
+    worker.install_signal_handlers()
+    worker.ready = True
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    worker.drain()
+    listener.stop()
+    product_changes.stop()
+    sales_rollups.stop()
+    # uvicorn уже дождался ответов, но обработчики, которые он перестал ждать, ещё могут
+    # выполняться в потоках threadpool — даём их транзакциям (оплатам) завершиться
+    busy = pool.drain(lifecycle.SHUTDOWN_DRAIN_TIMEOUT)
+    if busy:
+        logger.warning("Shutting down with %s database connections still in use", busy)
+    passwords.shutdown()
+    activity_log.stop()
+    replicas.close()
+    pool.close()
+    metrics.shutdown_logging()
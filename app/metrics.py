@@ -0,0 +1,232 @@
+"""Метрики запросов в формате Prometheus и структурированные логи.
+
+MetricsMiddleware измеряет каждый HTTP-запрос: время ответа, время в базе и
+число запросов к ней. Последние два собирает InstrumentedCursor — фабрика
+курсоров пула — в счётчики текущего запроса (contextvars переходят в поток
+threadpool вместе с контекстом). Снимки stats() пула, кэшей и других
+компонентов отдаются на /metrics как gauge через register_stats().
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from psycopg2.extras import RealDictCursor
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json — одна строка JSON на запись, text — читаемый формат для разработки
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# доля успешных запросов, попадающих в лог; медленные и 5xx пишутся всегда
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.01"))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_MS", "500")) / 1000
+
+logger = logging.getLogger("shop.requests")
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request",
+    ["method", "route", "status"],
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in database calls per HTTP request",
+    ["method", "route"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database calls per HTTP request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+
+# {"queries": int, "db_seconds": float} текущего запроса или None вне запроса
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor, засчитывающий вызовы в статистику текущего запроса."""
+
+    def _timed(self, method, *args, **kwargs):
+        stats = _request_stats.get()
+        if stats is None:
+            return method(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats["queries"] += 1
+            stats["db_seconds"] += time.perf_counter() - start
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+    def callproc(self, procname, vars=None):
+        return self._timed(super().callproc, procname, vars)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = {"queries": 0, "db_seconds": 0.0}
+        token = _request_stats.set(stats)
+        status_code = 500
+        event_stream = False
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                event_stream = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - start
+            # шаблон маршрута проставляет роутер; неизвестные пути не плодят метки
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.labels(method, route, status_code).observe(elapsed)
+            REQUEST_DB_SECONDS.labels(method, route).observe(stats["db_seconds"])
+            REQUEST_QUERIES.labels(method, route).observe(stats["queries"])
+            # поток SSE живёт минутами — это не медленный запрос
+            if not event_stream:
+                log_request(method, route, scope["path"], status_code, elapsed, stats)
+
+
+def log_request(method, route, path, status_code, elapsed, stats):
+    if status_code >= 500 or elapsed >= SLOW_REQUEST_SECONDS:
+        level = logging.WARNING
+    elif random.random() < REQUEST_LOG_SAMPLE_RATE:
+        level = logging.INFO
+    else:
+        return
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, "request", extra={
+        "method": method,
+        "route": route,
+        "path": path,
+        "status": status_code,
+        "duration_ms": round(elapsed * 1000, 3),
+        "db_ms": round(stats["db_seconds"] * 1000, 3),
+        "queries": stats["queries"],
+    })
+
+
+class StatsCollector:
+    """Отдаёт снимки stats() компонентов как gauge на каждом scrape."""
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, prefix, stats, label=None):
+        self._sources[prefix] = (stats, label)
+
+    def collect(self):
+        for prefix, (stats, label) in self._sources.items():
+            snapshot = stats()
+            if label is None:
+                snapshot = {None: snapshot}
+            families = {}
+            for label_value, values in snapshot.items():
+                for key, value in values.items():
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        continue
+                    family = families.get(key)
+                    if family is None:
+                        family = families[key] = GaugeMetricFamily(
+                            f"shop_{prefix}_{key}", f"{prefix} {key.replace('_', ' ')}",
+                            labels=[label] if label else None,
+                        )
+                    family.add_metric([label_value] if label else [], value)
+            yield from families.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def register_stats(prefix, stats, label=None):
+    """stats() -> {name: number}; с label — {label_value: {name: number}}."""
+    stats_collector.register(prefix, stats, label)
+
+
+def render():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # несколько воркеров (gunicorn.conf.py): гистограммы и счётчики суммируются по всем
+        # процессам из общего каталога, а снимки stats() — только того, кто отвечает на scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_log_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Записи форматируются в вызывающем потоке, а пишутся в stdout фоновым потоком."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.setFormatter(formatter)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    _log_listener = logging.handlers.QueueListener(handler.queue, output)
+    _log_listener.start()
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def shutdown_logging():
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
@@ -0,0 +1,100 @@
+"""Применяет SQL-миграции из каталога migrations/.
+
+Файлы называются NNNN_описание.sql и применяются по возрастанию номера,
+каждый в своей транзакции; применённые версии записываются в
+schema_migrations. Параллельные запуски (несколько воркеров) выстраиваются
+в очередь на advisory lock, а на актуальной базе всё сводится к одному SELECT.
+
+    python migrate.py
+"""
+import logging
+import os
+import re
+
+import psycopg2
+
+from database import DATABASE_URL
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# произвольная константа, общая для всех процессов приложения
+MIGRATION_LOCK_KEY = 7302154011
+
+
+def available_migrations():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r"^(\d+)_(.+)\.sql$", filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return set()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    migrations = available_migrations()
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        pending = [m for m in migrations if m[0] not in applied_versions(cursor)]
+    conn.rollback()
+    if not pending:
+        return []
+
+    applied = []
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+            # пока мы ждали блокировку, миграции мог применить другой процесс
+            done = applied_versions(cursor)
+            for version, name, path in migrations:
+                if version in done:
+                    continue
+                with open(path, "r", encoding="utf-8") as file:
+                    cursor.execute(file.read())
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name),
+                )
+                conn.commit()
+                applied.append(version)
+                logger.info("Applied migration %04d_%s", version, name)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+    return applied
+
+
+def run(dsn=DATABASE_URL):
+    conn = psycopg2.connect(dsn)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    applied = run()
+    print(f"Applied {len(applied)} migration(s)" if applied else "Database schema is up to date")
@@ -0,0 +1,23 @@
+-- Рекомендации, рассчитываемые пакетно из user_logs и order_items
+
+ALTER TABLE recommendations ADD COLUMN IF NOT EXISTS score REAL;
+ALTER TABLE recommendations ADD COLUMN IF NOT EXISTS rank SMALLINT;
+CREATE INDEX IF NOT EXISTS idx_recommendations_user_id ON recommendations (user_id, rank);
+
+-- Накопленный вес взаимодействий пользователя с товаром
+CREATE TABLE IF NOT EXISTS user_item_interactions (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    weight REAL NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, product_id)
+);
+
+-- До каких строк user_logs и order_items данные уже учтены
+CREATE TABLE IF NOT EXISTS recommendation_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_log_id INT NOT NULL DEFAULT 0,
+    last_order_item_id INT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP
+);
+INSERT INTO recommendation_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
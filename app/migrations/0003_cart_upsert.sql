@@ -0,0 +1,31 @@
+-- Одна корзина на пользователя и одна строка на товар в корзине,
+-- чтобы изменения корзины выполнялись одним INSERT ... ON CONFLICT
+
+-- Переносим товары из лишних корзин пользователя в самую раннюю
+UPDATE cart_items ci
+SET cart_id = keep.id
+FROM cart c
+JOIN (SELECT user_id, MIN(id) AS id FROM cart GROUP BY user_id) keep ON keep.user_id = c.user_id
+WHERE ci.cart_id = c.id AND c.id <> keep.id;
+
+DELETE FROM cart c
+USING cart other
+WHERE c.user_id = other.user_id AND c.id > other.id;
+
+-- Сливаем повторяющиеся строки одного товара, суммируя количество
+UPDATE cart_items ci
+SET quantity = dup.quantity
+FROM (
+    SELECT MIN(id) AS id, SUM(quantity) AS quantity
+    FROM cart_items
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+) dup
+WHERE ci.id = dup.id;
+
+DELETE FROM cart_items ci
+USING cart_items other
+WHERE ci.cart_id = other.cart_id AND ci.product_id = other.product_id AND ci.id > other.id;
+
+ALTER TABLE cart ADD CONSTRAINT cart_user_id_key UNIQUE (user_id);
+ALTER TABLE cart_items ADD CONSTRAINT cart_items_cart_id_product_id_key UNIQUE (cart_id, product_id);
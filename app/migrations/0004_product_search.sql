@@ -0,0 +1,12 @@
+-- Полнотекстовый (русская морфология) и нечёткий (триграммы) поиск по товарам
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_products_search_vector ON products USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
@@ -0,0 +1,62 @@
+-- Таблица замыкания дерева категорий: все пары (предок, потомок), включая (id, id).
+-- «Все товары в Электронике» — один индексный запрос вместо рекурсивного обхода.
+
+CREATE TABLE IF NOT EXISTS category_closure (
+    ancestor_id INT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    descendant_id INT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    depth INT NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+CREATE INDEX IF NOT EXISTS idx_category_closure_descendant_id ON category_closure (descendant_id);
+
+INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree AS (
+    SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth FROM categories
+    UNION ALL
+    SELECT t.ancestor_id, c.id, t.depth + 1
+    FROM tree t
+    JOIN categories c ON c.parent_id = t.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM tree
+ON CONFLICT DO NOTHING;
+
+-- Новая категория наследует всех предков родителя
+CREATE OR REPLACE FUNCTION category_closure_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, NEW.id, depth + 1 FROM category_closure WHERE descendant_id = NEW.parent_id
+    UNION ALL
+    SELECT NEW.id, NEW.id, 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Смена родителя (в том числе ON DELETE SET NULL) переносит всё поддерево
+CREATE OR REPLACE FUNCTION category_closure_move() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM category_closure cc
+    USING category_closure sub, category_closure sup
+    WHERE sub.ancestor_id = NEW.id
+      AND cc.descendant_id = sub.descendant_id
+      AND sup.descendant_id = NEW.id
+      AND sup.ancestor_id <> NEW.id
+      AND cc.ancestor_id = sup.ancestor_id;
+
+    INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+    SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+    FROM category_closure sup, category_closure sub
+    WHERE sup.descendant_id = NEW.parent_id AND sub.ancestor_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS categories_closure_insert ON categories;
+CREATE TRIGGER categories_closure_insert
+    AFTER INSERT ON categories
+    FOR EACH ROW EXECUTE FUNCTION category_closure_insert();
+
+DROP TRIGGER IF EXISTS categories_closure_move ON categories;
+CREATE TRIGGER categories_closure_move
+    AFTER UPDATE OF parent_id ON categories
+    FOR EACH ROW WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION category_closure_move();
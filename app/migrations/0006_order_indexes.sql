@@ -0,0 +1,4 @@
+-- История заказов пользователя (keyset по created_at, id) и позиции заказа.
+-- cart.user_id уже проиндексирован уникальным ограничением из 0003.
+CREATE INDEX IF NOT EXISTS idx_orders_user_id_created_at ON orders (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
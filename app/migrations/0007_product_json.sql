@@ -0,0 +1,32 @@
+-- Готовый JSON товара в формате ProductResponse: списки собираются склейкой
+-- строк без построчной валидации и сериализации в приложении.
+-- Поддерживается триггером при любом изменении полей товара (включая остаток при покупке).
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS api_json TEXT;
+
+CREATE OR REPLACE FUNCTION product_api_json(p products) RETURNS TEXT AS $$
+    SELECT json_build_object(
+        'id', p.id,
+        'name', p.name,
+        'description', p.description,
+        'price', p.price,
+        'stock', p.stock,
+        'category_id', p.category_id,
+        'attributes', p.attributes,
+        'created_at', p.created_at
+    )::text
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION products_set_api_json() RETURNS trigger AS $$
+BEGIN
+    NEW.api_json := product_api_json(NEW);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_api_json ON products;
+CREATE TRIGGER products_api_json
+    BEFORE INSERT OR UPDATE OF name, description, price, stock, category_id, attributes, created_at ON products
+    FOR EACH ROW EXECUTE FUNCTION products_set_api_json();
+
+UPDATE products p SET api_json = product_api_json(p);
@@ -0,0 +1,34 @@
+-- Версия товара для ленты изменений (GET /products/changes): id транзакции,
+-- последней изменившей строку. Всё, что меньше xmin текущего снимка, уже
+-- завершено, поэтому лента может сдвигать курсор, не пропуская транзакции,
+-- которые закоммитились позже более новых.
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT txid_current();
+ALTER TABLE products ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_products_version ON products (version, id);
+
+CREATE OR REPLACE FUNCTION products_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := txid_current();
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_bump_version ON products;
+CREATE TRIGGER products_bump_version
+    BEFORE UPDATE OF name, description, price, stock, category_id, attributes ON products
+    FOR EACH ROW EXECUTE FUNCTION products_bump_version();
+
+-- одно уведомление на оператор (и на транзакцию: одинаковые payload схлопываются)
+CREATE OR REPLACE FUNCTION products_notify_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('product_changes', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_notify_changed ON products;
+CREATE TRIGGER products_notify_changed
+    AFTER INSERT OR UPDATE OF name, description, price, stock, category_id, attributes ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION products_notify_changed();
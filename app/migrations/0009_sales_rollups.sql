@@ -0,0 +1,49 @@
+-- Сводки продаж для отчётов администратора (см. analytics.py). Фоновое
+-- обновление добавляет в них только заказы, появившиеся после прошлого
+-- прохода; отчёты читают сводки, а не orders и order_items.
+
+-- id транзакции, создавшей заказ. Столбец без значения по умолчанию для
+-- старых строк добавляется без перезаписи таблицы; такие заказы (NULL)
+-- учитываются один раз при первом обновлении.
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_txid BIGINT;
+ALTER TABLE orders ALTER COLUMN created_txid SET DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS idx_orders_created_txid ON orders (created_txid);
+
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE PRIMARY KEY,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL
+);
+
+-- category_id = 0 — товары без категории
+CREATE TABLE IF NOT EXISTS sales_daily_category (
+    day DATE NOT NULL,
+    category_id INT NOT NULL,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (day, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS sales_daily_product (
+    day DATE NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (day, product_id)
+);
+-- продажи одного товара за последние дни (отчёт об остатках)
+CREATE INDEX IF NOT EXISTS idx_sales_daily_product_product_id ON sales_daily_product (product_id, day);
+
+-- До какой транзакции заказы уже учтены в сводках
+CREATE TABLE IF NOT EXISTS analytics_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_txid BIGINT NOT NULL DEFAULT 0,
+    backfilled BOOLEAN NOT NULL DEFAULT FALSE,
+    refreshed_at TIMESTAMP
+);
+INSERT INTO analytics_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_products_stock ON products (stock, id);
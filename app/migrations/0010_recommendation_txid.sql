@@ -0,0 +1,16 @@
+-- Отметка рекомендаций по id транзакций вместо MAX(id): id строки выдаётся
+-- до коммита, и строка ещё идущей транзакции с меньшим id появилась бы уже
+-- после того, как отметка ушла дальше неё. Транзакции ниже xmin снимка
+-- завершены, поэтому отметка по ним ничего не пропускает (см. recommender.py).
+
+-- старые строки (NULL) добираются по прежним отметкам last_log_id/last_order_item_id
+ALTER TABLE user_logs ADD COLUMN IF NOT EXISTS created_txid BIGINT;
+ALTER TABLE user_logs ALTER COLUMN created_txid SET DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS idx_user_logs_created_txid ON user_logs (created_txid);
+
+ALTER TABLE order_items ADD COLUMN IF NOT EXISTS created_txid BIGINT;
+ALTER TABLE order_items ALTER COLUMN created_txid SET DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS idx_order_items_created_txid ON order_items (created_txid);
+
+-- NULL — отметка по транзакциям ещё не заведена
+ALTER TABLE recommendation_state ADD COLUMN IF NOT EXISTS last_txid BIGINT;
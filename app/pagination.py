@@ -0,0 +1,71 @@
+import base64
+import json
+import math
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _int(value):
+    # значения уходят в запрос как int4 — за его пределами Postgres ответил бы ошибкой
+    if isinstance(value, bool) or not isinstance(value, int) or not -2**31 <= value < 2**31:
+        raise ValueError(value)
+    return value
+
+
+def _float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(value)
+    return value
+
+
+def _numeric(value):
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError(value)
+    number = Decimal(str(value))
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+
+def _timestamp(value):
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return datetime.fromisoformat(value)
+
+
+def _text(value):
+    if not isinstance(value, str) or "\x00" in value:
+        raise ValueError(value)
+    return value
+
+
+# тип значения в курсоре (как в приведении %s::тип в запросе) -> проверка
+CURSOR_TYPES = {
+    "int": _int,
+    "float": _float,
+    "numeric": _numeric,
+    "timestamp": _timestamp,
+    "text": _text,
+}
+
+
+def decode_cursor(cursor: str, *types: str):
+    """Значения курсора, проверенные по типам: подделанный курсор даёт 400, а не ошибку базы."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        return [CURSOR_TYPES[kind](value) for kind, value in zip(types, values)]
+    except (ValueError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
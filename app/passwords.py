@@ -0,0 +1,84 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt отпускает GIL, поэтому потоков достаточно; по умолчанию по одному на ядро
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 2)))
+# сколько операций может ждать свободного потока, прежде чем отвечать 503
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+
+# хеши с другим числом раундов помечаются устаревшими и пересчитываются при входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+_in_flight = 0
+_stats = {"completed": 0, "failed": 0, "rejected": 0, "rehashed": 0}
+
+
+def _done(future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+        _stats["failed" if future.cancelled() or future.exception() is not None else "completed"] += 1
+
+
+def _submit(fn, *args):
+    global _in_flight
+    with _lock:
+        if _in_flight >= PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            raise PasswordHasherBusy("Password hashing queue is full")
+        _in_flight += 1
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        with _lock:
+            _in_flight -= 1
+        raise
+    future.add_done_callback(_done)
+    return asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    return await _submit(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed: str):
+    """Возвращает (верен ли пароль, новый хеш или None, если пересчёт не нужен)."""
+    valid, new_hash = await _submit(pwd_context.verify_and_update, password, hashed)
+    if new_hash is not None:
+        with _lock:
+            _stats["rehashed"] += 1
+    return valid, new_hash
+
+
+def stats():
+    with _lock:
+        return {
+            "workers": PASSWORD_WORKERS,
+            "queue_limit": PASSWORD_QUEUE_LIMIT,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "in_flight": _in_flight,
+            **_stats,
+        }
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
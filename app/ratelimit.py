@@ -0,0 +1,245 @@
+"""Ограничение частоты и параллельности запросов к дорогим маршрутам.
+
+Правило задаётся для пары «метод путь» и действует на клиента — пользователя
+(sub из Bearer-токена) или IP-адрес:
+
+- rate/burst — token bucket: в среднем rate запросов в секунду, всплеск до burst;
+- concurrency — одновременных запросов одного клиента;
+- route_concurrency — одновременных запросов к маршруту от всех клиентов.
+
+Проверка идёт до роутинга и чтения тела, поэтому отказ (429 с Retry-After)
+почти ничего не стоит. Счётчики параллельности живут в процессе: они
+защищают ресурсы воркера (соединения пула, потоки bcrypt). Token bucket по
+умолчанию тоже в памяти воркера; с RATE_LIMIT_REDIS_URL он общий для всех
+воркеров и машин. Если Redis недоступен, запросы пропускаются.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis нужен только для общего хранилища
+    aioredis = None
+
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+# запрос к Redis дольше этого не ждём и пропускаем клиента
+RATE_LIMIT_REDIS_TIMEOUT = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+# сколько клиентов помнит хранилище в памяти; самые давние вытесняются
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+DEFAULT_LIMITS = {
+    "POST /login": {"rate": 0.5, "burst": 10, "concurrency": 2, "key": "ip"},
+    "POST /register": {"rate": 0.1, "burst": 5, "concurrency": 2, "key": "ip"},
+    "POST /purchase": {"rate": 1, "burst": 5, "concurrency": 2, "key": "user"},
+    "GET /products": {"rate": 5, "burst": 20, "concurrency": 4, "route_concurrency": 16, "key": "ip"},
+}
+
+DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Rate limiter decisions by route and outcome",
+    ["route", "decision"],
+)
+
+
+class Rule:
+    KEYS = ("ip", "user")
+
+    def __init__(self, route, rate=None, burst=None, concurrency=None, route_concurrency=None, key="ip"):
+        if key not in self.KEYS:
+            raise ValueError(f"{route}: key must be one of {', '.join(self.KEYS)}")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"{route}: rate must be positive")
+        self.route = route
+        self.rate = rate
+        self.burst = max(1, burst if burst is not None else math.ceil(rate or 1))
+        self.concurrency = concurrency
+        self.route_concurrency = route_concurrency
+        self.key = key
+        self.in_flight = 0
+        self.clients = {}  # клиент -> запросов в обработке
+
+
+def load_rules(overrides=None):
+    """{(метод, путь): Rule}; overrides поверх DEFAULT_LIMITS, null отключает правило."""
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(overrides if overrides is not None else json.loads(os.getenv("RATE_LIMITS", "{}")))
+    rules = {}
+    for route, params in limits.items():
+        if params is None:
+            continue
+        method, path = route.split(" ", 1)
+        rules[(method.upper(), path)] = Rule(route, **params)
+    return rules
+
+
+class MemoryBuckets:
+    """Token bucket в памяти процесса."""
+
+    def __init__(self, maxsize=RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (токены, время)
+
+    async def take(self, key, rate, burst):
+        """0, если токен взят, иначе через сколько секунд он появится."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # вытесненный клиент дольше всех не обращался — его ведро почти наверняка уже полное
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def stats(self):
+        return {"keys": len(self._buckets)}
+
+
+# состояние ведра в hash; время берётся у Redis, чтобы часы воркеров не расходились
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+
+class RedisBuckets:
+    """Token bucket в Redis, общий для всех воркеров."""
+
+    def __init__(self, url, timeout=RATE_LIMIT_REDIS_TIMEOUT):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        self.client = aioredis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._take = self.client.register_script(TAKE_SCRIPT)
+        self.errors = 0
+
+    async def take(self, key, rate, burst):
+        try:
+            return float(await self._take(keys=[f"ratelimit:{key}"], args=[rate, burst]))
+        except Exception as e:
+            # ограничитель не должен ронять сервис: без Redis запросы пропускаются
+            self.errors += 1
+            logger.warning("Rate limit backend error: %s", e)
+            return 0.0
+
+    def stats(self):
+        return {"backend_errors": self.errors}
+
+
+class RateLimiter:
+    def __init__(self, rules, buckets, user_from_token=None):
+        self.rules = rules
+        self.buckets = buckets
+        # токен -> идентификатор пользователя или None; без него правила key=user считают по IP
+        self.user_from_token = user_from_token
+
+    def client(self, scope, rule):
+        if rule.key == "user" and self.user_from_token is not None:
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    scheme, _, token = value.decode("latin-1").partition(" ")
+                    user = self.user_from_token(token) if scheme.lower() == "bearer" else None
+                    if user is not None:
+                        return f"user:{user}"
+                    break
+        # за прокси адрес клиента подставляет uvicorn --proxy-headers
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    def stats(self):
+        return {
+            rule.route: {"in_flight": rule.in_flight, "clients": len(rule.clients)}
+            for rule in self.rules.values()
+        }
+
+
+class RateLimitMiddleware:
+    """Отклоняет запросы сверх лимитов правил ответом 429 до роутинга."""
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        rule = self.limiter.rules.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        # сначала дешёвые проверки параллельности, чтобы отказ по ним не тратил токен
+        client = self.limiter.client(scope, rule)
+        if rule.route_concurrency is not None and rule.in_flight >= rule.route_concurrency:
+            await self._reject(rule, "route_concurrency", 1, send)
+            return
+        if rule.concurrency is not None and rule.clients.get(client, 0) >= rule.concurrency:
+            await self._reject(rule, "concurrency", 1, send)
+            return
+        if rule.rate is not None:
+            retry_after = await self.limiter.buckets.take(f"{rule.route}:{client}", rule.rate, rule.burst)
+            if retry_after > 0:
+                await self._reject(rule, "rate", retry_after, send)
+                return
+
+        DECISIONS.labels(rule.route, "allowed").inc()
+        rule.in_flight += 1
+        rule.clients[client] = rule.clients.get(client, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            rule.in_flight -= 1
+            remaining = rule.clients[client] - 1
+            if remaining:
+                rule.clients[client] = remaining
+            else:
+                del rule.clients[client]
+
+    @staticmethod
+    async def _reject(rule, decision, retry_after, send):
+        DECISIONS.labels(rule.route, decision).inc()
+        body = json.dumps({"detail": "Too many requests, try again later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_buckets():
+    return RedisBuckets(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBuckets()
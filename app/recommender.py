@@ -0,0 +1,231 @@
+"""Пакетный расчёт рекомендаций «товар-товар» по user_logs и order_items.
+
+Новые строки логов и заказов (после сохранённой отметки) сворачиваются в
+user_item_interactions, по ним строится матрица пользователь×товар, а из неё —
+косинусная близость товаров по совместной встречаемости. Для каждого
+пользователя в recommendations записываются top-N товаров, с которыми он ещё
+не взаимодействовал.
+
+    python recommender.py          # учесть новые события, пересчитать затронутых пользователей
+    python recommender.py --full   # пересчитать рекомендации всем пользователям
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import psycopg2
+from scipy import sparse
+
+import activity
+from database import DATABASE_URL
+
+
+RECOMMENDATIONS_TOP_N = int(os.getenv("RECOMMENDATIONS_TOP_N", "10"))
+# сколько ближайших соседей хранится для каждого товара
+RECOMMENDATIONS_ITEM_NEIGHBORS = int(os.getenv("RECOMMENDATIONS_ITEM_NEIGHBORS", "50"))
+
+ACTION_WEIGHTS = {
+    activity.VIEWED_PRODUCT: 1.0,
+    activity.ADDED_TO_CART: 3.0,
+    activity.REMOVED_FROM_CART: -1.0,
+}
+ORDER_WEIGHT = 5.0
+RECOMMENDER_LOCK_KEY = 7302154012
+
+
+def top_n_per_row(matrix, n):
+    """Для каждой строки разреженной матрицы — n наибольших значений.
+
+    Возвращает (rows, cols, values, ranks) без цикла по строкам.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    # строки в CSR уже упорядочены, поэтому сортировка только переставляет значения внутри строки
+    order = np.lexsort((-matrix.data, rows))
+    ranks = np.arange(len(order)) - matrix.indptr[rows]
+    keep = ranks < n
+    selected = order[keep]
+    return rows[keep], matrix.indices[selected], matrix.data[selected], ranks[keep]
+
+
+def item_similarity(interactions, neighbors=RECOMMENDATIONS_ITEM_NEIGHBORS):
+    norms = np.sqrt(np.asarray(interactions.multiply(interactions).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = interactions @ sparse.diags(1.0 / norms)
+    similarity = (normalized.T @ normalized).tocsr()
+    similarity.setdiag(0)
+    rows, cols, values, _ = top_n_per_row(similarity, neighbors)
+    return sparse.csr_matrix((values, (rows, cols)), shape=similarity.shape)
+
+
+def compute_recommendations(user_ids, product_ids, weights, target_user_ids=None,
+                            top_n=RECOMMENDATIONS_TOP_N, neighbors=RECOMMENDATIONS_ITEM_NEIGHBORS):
+    """Возвращает (user_ids, product_ids, scores, ranks) для целевых пользователей.
+
+    Без target_user_ids считает для всех пользователей из входных данных.
+    """
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    products, product_index = np.unique(product_ids, return_inverse=True)
+    interactions = sparse.csr_matrix(
+        (np.log1p(weights), (user_index, product_index)),
+        shape=(len(users), len(products)),
+    )
+    similarity = item_similarity(interactions, neighbors)
+
+    if target_user_ids is None:
+        target_rows = np.arange(len(users))
+    else:
+        target_rows = np.flatnonzero(np.isin(users, target_user_ids))
+
+    target = interactions[target_rows]
+    scores = (target @ similarity).tocsr()
+    # не рекомендуем то, с чем пользователь уже взаимодействовал
+    seen = target.copy()
+    seen.data[:] = 1.0
+    scores = scores - scores.multiply(seen)
+
+    rows, cols, values, ranks = top_n_per_row(scores, top_n)
+    return users[target_rows[rows]], products[cols], values, ranks + 1
+
+
+def ingest_new_events(cursor):
+    """Добавляет новые события в user_item_interactions и сдвигает отметку.
+
+    Отметка — id транзакции: берутся строки транзакций от прошлой отметки до
+    xmin текущего снимка. Все они уже завершены, поэтому строка транзакции,
+    закоммиченной позже более новых, не пропускается. Строки, добавленные до
+    миграции 0010 (created_txid IS NULL), добираются по прежним отметкам id.
+
+    Возвращает id пользователей, у которых появились новые события.
+    """
+    cursor.execute("SELECT last_log_id, last_order_item_id, last_txid FROM recommendation_state FOR UPDATE")
+    last_log_id, last_order_item_id, last_txid = cursor.fetchone()
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    horizon = cursor.fetchone()[0]
+
+    cursor.execute("""
+        INSERT INTO user_item_interactions (user_id, product_id, weight)
+        SELECT user_id, product_id, SUM(weight)
+        FROM (
+            SELECT l.user_id, l.product_id, w.weight
+            FROM user_logs l
+            JOIN unnest(%(actions)s::text[], %(weights)s::real[]) AS w(action, weight) ON w.action = l.action
+            WHERE l.created_txid >= %(last_txid)s AND l.created_txid < %(horizon)s
+              AND l.user_id IS NOT NULL AND l.product_id IS NOT NULL
+            UNION ALL
+            SELECT l.user_id, l.product_id, w.weight
+            FROM user_logs l
+            JOIN unnest(%(actions)s::text[], %(weights)s::real[]) AS w(action, weight) ON w.action = l.action
+            WHERE %(legacy)s AND l.created_txid IS NULL AND l.id > %(last_log_id)s
+              AND l.user_id IS NOT NULL AND l.product_id IS NOT NULL
+            UNION ALL
+            SELECT o.user_id, oi.product_id, %(order_weight)s
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            WHERE oi.created_txid >= %(last_txid)s AND oi.created_txid < %(horizon)s
+              AND o.user_id IS NOT NULL
+            UNION ALL
+            SELECT o.user_id, oi.product_id, %(order_weight)s
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            WHERE %(legacy)s AND oi.created_txid IS NULL AND oi.id > %(last_order_item_id)s
+              AND o.user_id IS NOT NULL
+        ) events
+        GROUP BY user_id, product_id
+        ON CONFLICT (user_id, product_id) DO UPDATE
+            SET weight = user_item_interactions.weight + EXCLUDED.weight,
+                updated_at = NOW()
+        RETURNING user_id
+    """, {
+        "actions": list(ACTION_WEIGHTS),
+        "weights": list(ACTION_WEIGHTS.values()),
+        "order_weight": ORDER_WEIGHT,
+        "last_txid": last_txid or 0,
+        "horizon": horizon,
+        # строки до миграции 0010 добираются один раз, при первом проходе с отметкой по транзакциям
+        "legacy": last_txid is None,
+        "last_log_id": last_log_id,
+        "last_order_item_id": last_order_item_id,
+    })
+    affected = np.unique(np.array([row[0] for row in cursor.fetchall()], dtype=np.int64))
+
+    cursor.execute("UPDATE recommendation_state SET last_txid = %s", (max(last_txid or 0, horizon),))
+    return affected
+
+
+def load_interactions(cursor):
+    buffer = io.StringIO()
+    cursor.copy_expert(
+        "COPY (SELECT user_id, product_id, weight FROM user_item_interactions WHERE weight > 0) TO STDOUT WITH CSV",
+        buffer,
+    )
+    buffer.seek(0)
+    data = np.loadtxt(buffer, delimiter=",", dtype=np.float64, ndmin=2)
+    if data.size == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+def write_recommendations(cursor, target_user_ids, user_ids, product_ids, scores, ranks):
+    if target_user_ids is None:
+        cursor.execute("DELETE FROM recommendations")
+    else:
+        cursor.execute("DELETE FROM recommendations WHERE user_id = ANY(%s)", (target_user_ids.tolist(),))
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack([user_ids, product_ids, scores, ranks]), fmt=["%d", "%d", "%.6f", "%d"], delimiter="\t")
+    buffer.seek(0)
+    cursor.copy_expert("COPY recommendations (user_id, product_id, score, rank) FROM STDIN", buffer)
+
+
+def refresh(conn, full=False, top_n=RECOMMENDATIONS_TOP_N, neighbors=RECOMMENDATIONS_ITEM_NEIGHBORS):
+    timings = {}
+    started = time.perf_counter()
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (RECOMMENDER_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            print("Another recommendation refresh is running, skipping")
+            return None
+
+        affected = ingest_new_events(cursor)
+        timings["ingest"] = time.perf_counter() - started
+        if not full and len(affected) == 0:
+            conn.commit()
+            return {"users": 0, "rows": 0, "seconds": timings}
+
+        user_ids, product_ids, weights = load_interactions(cursor)
+        timings["load"] = time.perf_counter() - started - timings["ingest"]
+
+        target = None if full else affected
+        if len(user_ids):
+            result = compute_recommendations(user_ids, product_ids, weights, target, top_n, neighbors)
+        else:
+            result = (np.empty(0, np.int64),) * 2 + (np.empty(0), np.empty(0, np.int64))
+        timings["compute"] = time.perf_counter() - started - timings["ingest"] - timings["load"]
+
+        write_recommendations(cursor, target, *result)
+        cursor.execute("UPDATE recommendation_state SET refreshed_at = NOW()")
+    conn.commit()
+    timings["total"] = time.perf_counter() - started
+    return {
+        "users": len(np.unique(result[0])),
+        "rows": len(result[0]),
+        "seconds": {name: round(value, 3) for name, value in timings.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild product recommendations")
+    parser.add_argument("--full", action="store_true", help="recompute every user, not only users with new events")
+    parser.add_argument("--top-n", type=int, default=RECOMMENDATIONS_TOP_N)
+    parser.add_argument("--neighbors", type=int, default=RECOMMENDATIONS_ITEM_NEIGHBORS)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        print(refresh(conn, full=args.full, top_n=args.top_n, neighbors=args.neighbors))
+    finally:
+        conn.close()
@@ -0,0 +1,275 @@
+"""Маршрутизация чтения на реплики (DATABASE_REPLICA_URLS).
+
+Запросы GET/HEAD читают через read_connection() с реплики, остальные методы —
+с основного сервера. После успешного изменяющего запроса клиент получает
+cookie, и его чтения ещё READ_YOUR_WRITES_SECONDS идут на основной сервер,
+чтобы он видел собственные изменения.
+
+Отставание реплики оценивается фоновым потоком по LSN: основной сервер
+периодически запоминает свою позицию WAL, и отставание — это сколько секунд
+назад основной сервер был в позиции, которую реплика ещё не воспроизвела.
+Реплика с отставанием больше REPLICA_MAX_LAG или недоступная исключается из
+ротации; если исправных реплик нет, чтение идёт на основной сервер.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.cookies import CookieError, SimpleCookie
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from database import ConnectionPool, PoolClosed, PoolTimeout, pool
+
+
+logger = logging.getLogger(__name__)
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# реплика, отстающая больше этого числа секунд, выводится из ротации
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "2"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+# сколько секунд после записи чтения клиента идут на основной сервер
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+PRIMARY_COOKIE = "db_primary_until"
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# True — чтения текущего запроса должны идти на основной сервер
+_prefer_primary = ContextVar("prefer_primary", default=True)
+
+
+def describe_dsn(dsn):
+    """host:port/dbname без пароля — для логов и меток метрик."""
+    params = parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+
+
+class Replica:
+    def __init__(self, dsn):
+        self.name = describe_dsn(dsn)
+        self.pool = ConnectionPool(dsn)
+        self.healthy = False
+        self.lag = None
+        self.reads = 0
+        self.errors = 0
+
+
+class ReplicaSet:
+    def __init__(self, dsns, primary, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.primary = primary
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # (время, позиция WAL основного сервера), от старых к новым
+        self._samples = deque()
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def open(self):
+        if not self.replicas or self._thread is not None:
+            return
+        for replica in self.replicas:
+            try:
+                replica.pool.open()
+            except psycopg2.Error as e:
+                # реплика поднимется позже — её подхватит проверка отставания
+                logger.warning("Replica %s is unavailable: %s", replica.name, e)
+        self.check()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-lag-check", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for replica in self.replicas:
+            replica.healthy = False
+            replica.pool.close()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def _primary_lsn(self):
+        try:
+            with self.primary.connection() as conn, conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+                cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')::bigint")
+                lsn = cursor.fetchone()[0]
+                conn.rollback()
+                return lsn
+        except Exception as e:
+            logger.warning("Cannot read primary WAL position: %s", e)
+            return None
+
+    def _lag(self, replay_lsn, now):
+        newest = self._samples[-1][1]
+        if replay_lsn >= newest:
+            return 0.0
+        # самый старый момент, когда основной сервер уже был дальше реплики
+        for sampled_at, lsn in self._samples:
+            if lsn > replay_lsn:
+                return now - sampled_at
+        return 0.0
+
+    def check(self):
+        now = time.monotonic()
+        primary_lsn = self._primary_lsn()
+        if primary_lsn is not None:
+            self._samples.append((now, primary_lsn))
+            # истории чуть больше порога достаточно, чтобы отличить «отстаёт» от «сильно отстаёт»
+            while len(self._samples) > 1 and now - self._samples[1][0] > self.max_lag * 2 + self.check_interval:
+                self._samples.popleft()
+
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection() as conn, conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+                    cursor.execute("""
+                        SELECT pg_is_in_recovery(),
+                               pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0')::bigint
+                    """)
+                    in_recovery, replay_lsn = cursor.fetchone()
+                    conn.rollback()
+            except Exception as e:
+                if replica.healthy:
+                    logger.warning("Replica %s removed from rotation: %s", replica.name, e)
+                replica.healthy = False
+                replica.lag = None
+                continue
+
+            if not in_recovery:
+                # самостоятельный сервер (например, в тестах) — отставания нет
+                lag = 0.0
+            elif primary_lsn is None or replay_lsn is None:
+                # сравнить не с чем — оставляем прежнее решение
+                continue
+            else:
+                lag = self._lag(replay_lsn, now)
+            healthy = lag <= self.max_lag
+            if healthy != replica.healthy:
+                logger.warning(
+                    "Replica %s %s rotation", replica.name, "returned to" if healthy else "removed from",
+                    extra={"replica": replica.name, "lag_seconds": round(lag, 3)},
+                )
+            replica.lag = lag
+            replica.healthy = healthy
+
+    @contextmanager
+    def connection(self):
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        conn = None
+        if healthy:
+            replica = healthy[next(self._round_robin) % len(healthy)]
+            try:
+                conn = replica.pool.getconn()
+            except (PoolTimeout, PoolClosed, psycopg2.OperationalError) as e:
+                logger.warning("Replica %s connection failed: %s", replica.name, e)
+                with self._lock:
+                    replica.errors += 1
+        if conn is None:
+            with self._lock:
+                self.fallbacks += 1
+            with self.primary.connection() as conn:
+                yield conn
+            return
+        with self._lock:
+            replica.reads += 1
+        try:
+            yield conn
+        finally:
+            replica.pool.putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "primary_reads": self.primary_reads,
+                "fallbacks": self.fallbacks,
+                "replicas": {
+                    replica.name: {
+                        "healthy": replica.healthy,
+                        "lag_seconds": None if replica.lag is None else round(replica.lag, 3),
+                        "reads": replica.reads,
+                        "errors": replica.errors,
+                        **replica.pool.stats(),
+                    }
+                    for replica in self.replicas
+                },
+            }
+
+
+replicas = ReplicaSet(DATABASE_REPLICA_URLS, pool)
+
+
+@contextmanager
+def read_connection():
+    """Соединение для чтения: реплика, если запрос это допускает, иначе основной сервер."""
+    if not replicas or _prefer_primary.get():
+        if replicas:
+            with replicas._lock:
+                replicas.primary_reads += 1
+        with pool.connection() as conn:
+            yield conn
+    else:
+        with replicas.connection() as conn:
+            yield conn
+
+
+def get_read_db():
+    with read_connection() as conn:
+        yield conn
+
+
+class ReadRoutingMiddleware:
+    """Разрешает чтение с реплик для GET/HEAD и ставит cookie-метку после записи."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        write = scope["method"] not in READ_METHODS
+        token = _prefer_primary.set(write or self._recently_wrote(scope))
+
+        async def send_wrapper(message):
+            if write and message["type"] == "http.response.start" and message["status"] < 400:
+                until = time.time() + READ_YOUR_WRITES_SECONDS
+                cookie = (
+                    f"{PRIMARY_COOKIE}={until:.0f}; Max-Age={READ_YOUR_WRITES_SECONDS:.0f}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _prefer_primary.reset(token)
+
+    @staticmethod
+    def _recently_wrote(scope):
+        for name, value in scope["headers"]:
+            if name != b"cookie":
+                continue
+            try:
+                morsel = SimpleCookie(value.decode("latin-1")).get(PRIMARY_COOKIE)
+                if morsel is not None:
+                    return float(morsel.value) > time.time()
+            except (CookieError, ValueError):
+                return False
+        return False
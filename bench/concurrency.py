@@ -0,0 +1,53 @@
+"""Throughput/latency of one endpoint at increasing client concurrency.
+
+    python bench/concurrency.py --url http://localhost:8000 \
+        --path "/recommendations?user_id=1" --levels 1,8,32,64 --requests 2000
+
+Run it against the app before and after a change and compare the tables:
+with blocking calls on the event loop req/s stays flat as concurrency grows.
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_level(url, concurrency, total):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        latencies = sorted(executor.map(lambda _: fetch(url), range(total)))
+        elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/recommendations?user_id=1")
+    parser.add_argument("--levels", default="1,8,32,64")
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + args.path
+    fetch(url)  # прогрев
+    print(f"{'conc':>5} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for level in (int(x) for x in args.levels.split(",")):
+        r = run_level(url, level, args.requests)
+        print(f"{r['concurrency']:>5} {r['rps']:>10.1f} {r['p50']:>10.2f} {r['p99']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""CPU cost of building a product listing: per-row validation vs. precomputed JSON.
+
+    python bench/product_json.py --rows 10000
+
+No database needed. Builds --rows product rows the way psycopg2 returns them
+and times the old path (ProductPage validation + serialization of every row)
+against the new one (concatenating the precomputed products.api_json
+strings), then prints a cProfile of each. Decoding on the database side also
+shrinks from eight typed columns per row to one text column, which this
+script does not measure.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from pydantic import TypeAdapter
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)  # main монтирует static/ относительно рабочего каталога
+
+import main  # noqa: E402
+
+
+def synthetic_rows(count, seed=0):
+    rng = random.Random(seed)
+    created = datetime(2026, 1, 1)
+    rows = []
+    for i in range(1, count + 1):
+        rows.append({
+            "id": i,
+            "name": f"Товар {i}",
+            "description": "Описание товара " * rng.randint(1, 8),
+            "price": Decimal(rng.randint(100, 1_000_000)) / 100,
+            "stock": rng.randint(0, 500),
+            "category_id": rng.randint(1, 50),
+            "attributes": {"color": rng.choice(["черный", "белый"]), "size": rng.randint(36, 46)},
+            "created_at": created + timedelta(seconds=i),
+        })
+    return rows
+
+
+def precomputed(rows):
+    # тот же формат, что даёт product_api_json() в Postgres
+    return [
+        {"id": row["id"], "api_json": json.dumps(row, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v), ensure_ascii=False)}
+        for row in rows
+    ]
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+    json_rows = precomputed(rows)
+    adapter = TypeAdapter(main.ProductPage)
+
+    def before():
+        return main.json_body(adapter, {"items": rows, "next_cursor": "abc"}).body
+
+    def after():
+        return main.product_list_body(json_rows, next_cursor="abc").body
+
+    for name, build in (("validate + dump_json", before), ("precomputed api_json", after)):
+        seconds = min(timeit.repeat(build, number=1, repeat=args.repeat))
+        print(f"{name:<24} {seconds * 1000:>8.2f} ms per {args.rows}-row response ({len(build())} bytes)")
+
+    for name, build in (("validate + dump_json", before), ("precomputed api_json", after)):
+        print(f"\n--- {name} ---")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for _ in range(args.repeat):
+            build()
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(8)
+
+
+if __name__ == "__main__":
+    main_()
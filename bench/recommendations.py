@@ -0,0 +1,56 @@
+"""Recommendation builder on a synthetic event log (no database needed).
+
+    python bench/recommendations.py --events 1000000 --users 100000 --products 20000
+
+Generates a Zipf-skewed user×product event log, aggregates it the way
+user_item_interactions does and times the co-occurrence computation and
+top-N selection for a full and an incremental (1% of users) refresh.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from recommender import compute_recommendations  # noqa: E402
+
+
+def synthetic_interactions(events, users, products, seed=0):
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(1, users + 1, size=events)
+    # популярность товаров распределена по Ципфу, как в настоящем каталоге
+    product_ids = np.minimum(rng.zipf(1.3, size=events), products)
+    weights = rng.choice([1.0, 3.0, 5.0], size=events, p=[0.7, 0.2, 0.1])
+    pairs = user_ids * (products + 1) + product_ids
+    unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+    summed = np.bincount(inverse, weights=weights)
+    return unique_pairs // (products + 1), unique_pairs % (products + 1), summed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    user_ids, product_ids, weights = synthetic_interactions(args.events, args.users, args.products)
+    print(f"aggregate {args.events} events -> {len(user_ids)} pairs: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    result = compute_recommendations(user_ids, product_ids, weights, top_n=args.top_n)
+    print(f"full refresh: {len(result[0])} rows for {len(np.unique(result[0]))} users: {time.perf_counter() - start:.2f}s")
+
+    targets = np.unique(user_ids)[:: 100]
+    start = time.perf_counter()
+    result = compute_recommendations(user_ids, product_ids, weights, targets, top_n=args.top_n)
+    print(f"incremental refresh ({len(targets)} users): {len(result[0])} rows: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
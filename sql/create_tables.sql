@@ -77,3 +77,132 @@ CREATE TABLE recommendations (
     product_id INT REFERENCES products(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Таблица: idempotency_keys (ответы на запросы с заголовком Idempotency-Key)
+CREATE TABLE idempotency_keys (
+    scope VARCHAR(100) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INT,
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+
+-- Индексы для постраничного каталога (keyset по (поле сортировки, id))
+CREATE INDEX idx_categories_parent_id ON categories (parent_id);
+CREATE INDEX idx_products_category_id ON products (category_id, id);
+CREATE INDEX idx_products_price_id ON products (price, id);
+CREATE INDEX idx_products_created_at_id ON products (created_at, id);
+CREATE INDEX idx_products_name_id ON products (name, id);
+CREATE INDEX idx_products_attributes ON products USING GIN (attributes jsonb_path_ops);
+
+-- Рекомендации, рассчитываемые пакетно (app/recommender.py)
+ALTER TABLE recommendations ADD COLUMN score REAL;
+ALTER TABLE recommendations ADD COLUMN rank SMALLINT;
+CREATE INDEX idx_recommendations_user_id ON recommendations (user_id, rank);
+
+-- Таблица: user_item_interactions (накопленный вес взаимодействий пользователя с товаром)
+CREATE TABLE user_item_interactions (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    weight REAL NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, product_id)
+);
+
+-- Таблица: recommendation_state (до каких строк user_logs и order_items данные учтены)
+CREATE TABLE recommendation_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_log_id INT NOT NULL DEFAULT 0,
+    last_order_item_id INT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP
+);
+
+-- Одна корзина на пользователя и одна строка на товар в корзине
+ALTER TABLE cart ADD CONSTRAINT cart_user_id_key UNIQUE (user_id);
+ALTER TABLE cart_items ADD CONSTRAINT cart_items_cart_id_product_id_key UNIQUE (cart_id, product_id);
+
+-- Полнотекстовый (русская морфология) и нечёткий (триграммы) поиск по товарам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+ALTER TABLE products ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED;
+CREATE INDEX idx_products_search_vector ON products USING GIN (search_vector);
+CREATE INDEX idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
+
+-- Таблица: category_closure (все пары предок-потомок в дереве категорий, поддерживается триггерами,
+-- см. app/migrations/0005_category_closure.sql)
+CREATE TABLE category_closure (
+    ancestor_id INT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    descendant_id INT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    depth INT NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+CREATE INDEX idx_category_closure_descendant_id ON category_closure (descendant_id);
+
+-- История заказов пользователя и позиции заказа
+CREATE INDEX idx_orders_user_id_created_at ON orders (user_id, created_at DESC, id DESC);
+CREATE INDEX idx_order_items_order_id ON order_items (order_id);
+
+-- Готовый JSON товара для выдачи списков (поддерживается триггером,
+-- см. app/migrations/0007_product_json.sql)
+ALTER TABLE products ADD COLUMN api_json TEXT;
+
+-- Версия товара для ленты изменений (поддерживается триггером,
+-- см. app/migrations/0008_catalog_version.sql)
+ALTER TABLE products ADD COLUMN version BIGINT NOT NULL DEFAULT txid_current();
+ALTER TABLE products ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX idx_products_version ON products (version, id);
+
+-- Дневные сводки продаж для отчётов администратора (пополняются только
+-- новыми заказами, см. app/analytics.py и app/migrations/0009_sales_rollups.sql)
+ALTER TABLE orders ADD COLUMN created_txid BIGINT DEFAULT txid_current();
+CREATE INDEX idx_orders_created_txid ON orders (created_txid);
+CREATE INDEX idx_products_stock ON products (stock, id);
+
+CREATE TABLE sales_daily (
+    day DATE PRIMARY KEY,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL
+);
+
+CREATE TABLE sales_daily_category (
+    day DATE NOT NULL,
+    category_id INT NOT NULL,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (day, category_id)
+);
+
+CREATE TABLE sales_daily_product (
+    day DATE NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    orders INT NOT NULL,
+    units BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (day, product_id)
+);
+CREATE INDEX idx_sales_daily_product_product_id ON sales_daily_product (product_id, day);
+
+-- Таблица: analytics_state (до какой транзакции заказы учтены в сводках)
+CREATE TABLE analytics_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_txid BIGINT NOT NULL DEFAULT 0,
+    backfilled BOOLEAN NOT NULL DEFAULT FALSE,
+    refreshed_at TIMESTAMP
+);
+
+-- id транзакции, добавившей строку: отметка инкрементального пересчёта рекомендаций
+-- (см. app/recommender.py и app/migrations/0010_recommendation_txid.sql)
+ALTER TABLE user_logs ADD COLUMN created_txid BIGINT DEFAULT txid_current();
+CREATE INDEX idx_user_logs_created_txid ON user_logs (created_txid);
+ALTER TABLE order_items ADD COLUMN created_txid BIGINT DEFAULT txid_current();
+CREATE INDEX idx_order_items_created_txid ON order_items (created_txid);
+ALTER TABLE recommendation_state ADD COLUMN last_txid BIGINT;